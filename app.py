@@ -1,14 +1,21 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
 import uuid
 import datetime
+import time
 from flask_mail import Mail, Message
 from db import connect_db
-from function import capture_face, load_student_faces, recognize_student_with_details
+from function import (best_matches, capture_face, classroom_recognizer, current_model, enroll_burst, enroll_faces,
+                      extract_face, recognize_student_with_details)
+from classroom_cache import classroom_models
+from attendance_window import attendance_key, recent_attendance
+import metrics
+import quality
+from metrics import timed
+from recognition_worker import RecognitionClient, run_recognition
+from detectors import thread_detector
 import base64
-import cv2
-import numpy as np
 
 
 app = Flask(__name__)
@@ -28,6 +35,25 @@ app.config['MAIL_PASSWORD'] = ''
 
 mail = Mail(app)
 
+# Build this thread's face detector now, so a missing cascade or DNN model file stops the app at startup
+# rather than failing every request that detects faces
+thread_detector()
+
+# Recognition jobs go to the warm worker service (recognition_worker.py) when SASC_WORKER_ADDRESS is set
+recognition_client = RecognitionClient() if os.environ.get('SASC_WORKER_ADDRESS') else None
+# How a call to the worker service fails: service down or connection dropped (OSError, EOFError), or the
+# job failed or was still pending when the client stopped waiting (RuntimeError)
+RECOGNITION_ERRORS = (OSError, EOFError, RuntimeError)
+# Longest a result poll may hold a web worker waiting for a job (?wait=, seconds)
+RESULT_WAIT_MAX = 10.0
+
+
+# Run a recognition job on the worker service if configured, otherwise inline in this process
+def run_recognition_job(kind, frames, classroom_id=None, roster=None):
+    if recognition_client is not None:
+        return recognition_client.recognize(kind, frames, classroom_id, roster)
+    return run_recognition(kind, frames, classroom_id, roster)
+
 # Admin Dashboard to manage classrooms and enrollments
 @app.route('/admin/dashboard')
 def admin_dashboard():
@@ -67,6 +93,7 @@ def enroll_student():
     else:
         cursor.execute("INSERT INTO enrollments (student_id, classroom_id) VALUES (%s, %s)", (student_id, classroom_id))
         db.commit()
+        classroom_models.invalidate(int(classroom_id))  # Roster changed, rebuild its recognizer on next use
         flash('Student enrolled successfully!', 'success')
 
     return redirect(url_for('admin_dashboard'))
@@ -104,6 +131,17 @@ def add_classroom():
 
 
 
+# Registration face image as bytes: a multipart file part, or the older base64 data URL form field;
+# None when nothing was sent. Credentials always travel as form fields next to it, never in the URL
+def read_face_upload():
+    upload = request.files.get('face_image')
+    if upload is not None and upload.filename:
+        return upload.read()  # Already buffered by werkzeug
+    if request.form.get('face_image'):
+        return base64.b64decode(request.form['face_image'].split(',')[-1])
+    return None
+
+
 # Route for registering a new user
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -114,29 +152,47 @@ def register():
         role = request.form['role']
         password = request.form['password']
         hashed_password = generate_password_hash(password)
-        face_image_data = request.form['face_image']
-
-        # Decode the face image from Base64
-        if face_image_data:
-            face_data = base64.b64decode(face_image_data.split(',')[1])
-            face_image = np.frombuffer(face_data, dtype=np.uint8)
-            face_image = cv2.imdecode(face_image, cv2.IMREAD_COLOR)
-
-            # Save the image (adjust the path as needed)
-            face_directory = f'faces/{user_id}'
-            if not os.path.exists(face_directory):
-                os.makedirs(face_directory)
-            cv2.imwrite(f'{face_directory}/{user_id}_1.jpg', face_image)
-
-        # Save user details and hashed password in the database (example)
+        face_image_data = read_face_upload()
+        frames = [frame.read() for frame in request.files.getlist('frames')]
+
+        # The account row goes in first, so face samples are never written for an ID nobody owns;
+        # it is committed only once the samples are saved
+        if role not in ('student', 'teacher'):
+            flash('Please choose whether you are registering as a student or a teacher.', 'error')
+            return redirect(url_for('register'))
         db = connect_db()
         cursor = db.cursor()
+        # Students and teachers share the faces/<id> namespace
+        if any(find_account(cursor, kind, user_id) is not None for kind in ('student', 'teacher')):
+            db.close()
+            flash(f'ID {user_id} is already registered.', 'error')
+            return redirect(url_for('register'))
         if role == 'student':
             cursor.execute("INSERT INTO students (student_id, name, email, password) VALUES (%s, %s, %s, %s)",
                            (user_id, name, email, hashed_password))
-        elif role == 'teacher':
+        else:
             cursor.execute("INSERT INTO teachers (teacher_id, name, email, password) VALUES (%s, %s, %s, %s)",
                            (user_id, name, email, hashed_password))
+
+        if frames:
+            # Multi-shot capture from the browser: enrolled in parallel, near-duplicates dropped
+            if not enroll_burst(user_id, frames)['enrolled']:
+                db.rollback()
+                db.close()
+                flash('No usable face was found in the captured images. Please face the camera and try again.', 'error')
+                return redirect(url_for('register'))
+        elif face_image_data:
+            # Detect, crop and normalize once at enrollment; only the 100x100 crop is stored
+            face_crop = extract_face(face_image_data)
+            if face_crop is None:
+                db.rollback()
+                db.close()
+                flash('No face was found in the captured image. Please face the camera and try again.', 'error')
+                return redirect(url_for('register'))
+
+            # Save the crop under faces/<id> and add it to the live recognizer
+            enroll_faces(user_id, [face_crop])
+
         db.commit()
         db.close()
 
@@ -146,6 +202,40 @@ def register():
     return render_template('register.html')
 
 
+# Primary key of the student or teacher account with this face ID, or None
+def find_account(cursor, role, face_id):
+    if role == 'student':
+        cursor.execute("SELECT id FROM students WHERE student_id = %s", (face_id,))
+    elif role == 'teacher':
+        cursor.execute("SELECT id FROM teachers WHERE teacher_id = %s", (face_id,))
+    else:
+        return None
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+# Add a burst of N frames from the browser to an existing student's samples in one request;
+# only the logged-in owner of the ID (or an admin) may add samples to it
+@app.route('/enroll/burst', methods=['POST'])
+def enroll_burst_endpoint():
+    user_id = request.form['user_id']
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please log in to add face samples.'}), 401
+    if session.get('role') != 'admin':
+        db = connect_db()
+        owner = find_account(db.cursor(), session.get('role'), user_id)
+        db.close()
+        if owner is None or owner != session['user_id']:
+            return jsonify({'error': 'You can only add face samples to your own ID.'}), 403
+
+    frames = [frame.read() for frame in request.files.getlist('frames')]
+    if not frames:
+        return jsonify({'error': 'No frames uploaded.'}), 400
+
+    result = enroll_burst(user_id, frames)
+    return jsonify(result), 200 if result['enrolled'] else 422
+
+
 # Classroom dashboard route
 @app.route('/classroom/dashboard/<int:classroom_id>')
 def classroom_dashboard(classroom_id):
@@ -173,41 +263,200 @@ def classroom_dashboard(classroom_id):
     attendance_records = cursor.fetchall()
 
     db.close()
-    return render_template('classroom_dashboard.html', classroom=classroom, attendance_records=attendance_records)
+    return render_template('classroom_dashboard.html', classroom=classroom, classroom_id=classroom_id,
+                           attendance_records=attendance_records)
 
 # Attendance capture route with live face detection
 @app.route('/classroom/capture', methods=['POST'])
 def capture_attendance():
     user_id = request.form['user_id']
     role = request.form['role']
+    classroom_id = int(request.form['classroom_id'])
     db = connect_db()
     cursor = db.cursor()
 
-    # Use OpenCV for live face capture and recognition
-    recognizer, student_ids = load_student_faces()  # Load trained face recognizer and student IDs
+    # Students are only matched against this classroom's roster. Attendance rows and the recent
+    # attendance keys use the account's primary key, not the face ID typed into the form
+    roster = classroom_roster(cursor, classroom_id) if role == 'student' else None
+    roster_ids = list(roster) if roster is not None else None
+    account_id = roster.get(user_id) if roster is not None else find_account(cursor, role, user_id)
+    if account_id is None:
+        db.close()
+        flash(f'No {role} with ID {user_id} is registered for this classroom.', 'error')
+        return redirect(url_for('classroom_dashboard', classroom_id=classroom_id))
 
-    # Recognize student in real-time using webcam
-    recognized_id = recognize_student_with_details(recognizer, student_ids)
+    # Already marked for this class today: skip recognition and the insert
+    key = attendance_key(role, account_id, classroom_id, datetime.date.today())
+    if recent_attendance.seen(key):
+        db.close()
+        flash(f'Attendance already recorded for {role} ID: {user_id}', 'info')
+        return redirect(url_for('classroom_dashboard', classroom_id=classroom_id))
+
+    frames = [frame.read() for frame in request.files.getlist('frames')]
+    if frames:
+        # Frames streamed from the dashboard's webcam, recognized in memory
+        try:
+            with timed('recognize', source='upload'):
+                results = run_recognition_job('frames', frames, classroom_id if roster is not None else None, roster_ids)
+        except RECOGNITION_ERRORS:
+            app.logger.exception('Recognition job for classroom %s failed', classroom_id)
+            db.close()
+            flash('Face recognition is unavailable right now. Please try again.', 'error')
+            return redirect(url_for('classroom_dashboard', classroom_id=classroom_id))
+        recognized_id = user_id if user_id in best_matches(results) else None
+    else:
+        # Use OpenCV for live face capture and recognition with the server's webcam
+        with timed('load_model'):
+            if roster is not None:
+                recognizer, student_ids, _ = classroom_recognizer(classroom_id, roster_ids)
+            else:
+                recognizer, student_ids = current_model()  # Live face recognizer and student IDs
+        with timed('recognize', source='camera'):
+            recognized_id = recognize_student_with_details(recognizer, student_ids)
 
     # Validate recognized ID
     if recognized_id is not None and recognized_id == user_id:
         timestamp = datetime.datetime.now()
 
-        # Update attendance record in the database based on role
-        if role == 'student':
-            cursor.execute("INSERT INTO attendance (classroom_id, student_id, timestamp, role) VALUES (%s, %s, %s, %s)",
-                           (1, user_id, timestamp, role))  # Use the correct classroom_id dynamically
-        elif role == 'teacher':
-            cursor.execute("INSERT INTO attendance (classroom_id, teacher_id, timestamp, role) VALUES (%s, %s, %s, %s)",
-                           (1, user_id, timestamp, role))
-
-        db.commit()
+        # Update attendance record in the database based on role; a repeat for the same day keeps the first row
+        with timed('db_insert'):
+            if role == 'student':
+                cursor.execute("INSERT INTO attendance (classroom_id, student_id, attendance_date, timestamp, role) "
+                               "VALUES (%s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE id = id",
+                               (classroom_id, account_id, timestamp.date(), timestamp, role))
+            elif role == 'teacher':
+                cursor.execute("INSERT INTO attendance (classroom_id, teacher_id, attendance_date, timestamp, role) "
+                               "VALUES (%s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE id = id",
+                               (classroom_id, account_id, timestamp.date(), timestamp, role))
+            db.commit()
+        recent_attendance.add(key)
         flash(f'Attendance captured for {role} ID: {user_id}', 'success')
     else:
         flash('Face recognition failed or ID mismatch. Please try again.', 'error')
 
     db.close()
-    return redirect(url_for('classroom_dashboard', classroom_id=1))  # Adjust classroom_id as needed
+    return redirect(url_for('classroom_dashboard', classroom_id=classroom_id))
+
+
+# Students enrolled in a classroom, as {face ID (students.student_id): students.id}
+def classroom_roster(cursor, classroom_id):
+    cursor.execute("""
+        SELECT students.id, students.student_id
+        FROM students
+        JOIN enrollments ON students.id = enrollments.student_id
+        WHERE enrollments.classroom_id = %s
+    """, (classroom_id,))
+    return {str(face_id): student_pk for student_pk, face_id in cursor.fetchall()}
+
+
+# Mark every enrolled student visible in a wide frame (or short burst) of the classroom
+@app.route('/classroom/<int:classroom_id>/capture_batch', methods=['POST'])
+def capture_attendance_batch(classroom_id):
+    frames = [frame.read() for frame in request.files.getlist('frames')]
+    if not frames:
+        flash('No frames received from the camera.', 'error')
+        return redirect(url_for('classroom_dashboard', classroom_id=classroom_id))
+
+    db = connect_db()
+    cursor = db.cursor()
+
+    # Only students enrolled in this classroom are candidates
+    roster = classroom_roster(cursor, classroom_id)
+    try:
+        with timed('recognize', source='classroom'):
+            matches = run_recognition_job('classroom', frames, classroom_id, list(roster))
+    except RECOGNITION_ERRORS:
+        app.logger.exception('Recognition job for classroom %s failed', classroom_id)
+        db.close()
+        flash('Face recognition is unavailable right now. Please try again.', 'error')
+        return redirect(url_for('classroom_dashboard', classroom_id=classroom_id))
+
+    if matches:
+        timestamp = datetime.datetime.now()
+        keys = {face_id: attendance_key('student', roster[face_id], classroom_id, timestamp.date()) for face_id in matches}
+        new_matches = [face_id for face_id in matches if not recent_attendance.seen(keys[face_id])]
+        if new_matches:
+            # Re-marking a student the same day only refreshes the status of the existing row
+            with timed('db_insert', rows=len(new_matches)):
+                cursor.executemany(
+                    "INSERT INTO attendance (classroom_id, student_id, attendance_date, timestamp, role, status) "
+                    "VALUES (%s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE status = VALUES(status)",
+                    [(classroom_id, roster[face_id], timestamp.date(), timestamp, 'student', 'present')
+                     for face_id in new_matches])
+                db.commit()
+            recent_attendance.add(*(keys[face_id] for face_id in new_matches))
+        flash(f'Attendance captured for {len(matches)} student(s): {", ".join(sorted(matches))}', 'success')
+    else:
+        flash('No enrolled students were recognized. Please try again.', 'error')
+
+    db.close()
+    return redirect(url_for('classroom_dashboard', classroom_id=classroom_id))
+
+
+# Per-stage timing histograms and quality rejections; Prometheus text, or JSON with ?format=json.
+# Covers this process only: workers of the recognition service log theirs (SASC_METRICS_LOG_INTERVAL)
+@app.route('/metrics')
+def metrics_endpoint():
+    if request.args.get('format') == 'json':
+        return jsonify({'stages': metrics.snapshot(), 'rejections': quality.rejection_counts()})
+    return metrics.render_prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
+# Recognize faces in a burst of JPEG/PNG frames posted by the browser, without touching a server camera
+@app.route('/classroom/recognize', methods=['POST'])
+def recognize_frames_endpoint():
+    frames = [frame.read() for frame in request.files.getlist('frames')]
+    if not frames:
+        return jsonify({'error': 'No frames uploaded.'}), 400
+
+    # ?async=1 hands the job to the worker service and returns at once; poll the returned URL for the result
+    try:
+        if recognition_client is not None and request.args.get('async'):
+            job_id = recognition_client.submit('frames', frames)
+            return jsonify({'job_id': job_id, 'poll': url_for('recognition_result', job_id=job_id)}), 202
+
+        start = time.perf_counter()
+        results = run_recognition_job('frames', frames)
+    except RECOGNITION_ERRORS:
+        app.logger.exception('Recognition service call failed')
+        return jsonify({'error': 'Recognition is unavailable right now.'}), 503
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return jsonify(recognition_response(results, elapsed_ms))
+
+
+# Result of an asynchronous recognition job: pending, done (with results) or error
+@app.route('/classroom/recognize/<int:job_id>')
+def recognition_result(job_id):
+    if recognition_client is None:
+        return jsonify({'error': 'Recognition worker is not configured.'}), 404
+
+    # ?wait=N blocks up to N seconds (at most RESULT_WAIT_MAX) for a pending job to finish
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds.'}), 400
+    wait = min(wait, RESULT_WAIT_MAX) if wait > 0 else 0.0  # Also maps nan to 0
+    try:
+        response = recognition_client.result(job_id, timeout=wait)
+    except RECOGNITION_ERRORS:
+        app.logger.exception('Recognition service call failed')
+        return jsonify({'error': 'Recognition is unavailable right now.'}), 503
+    if response['status'] == 'done':
+        return jsonify(recognition_response(response['result']))
+    return jsonify(response), 404 if response['status'] == 'unknown' else 200
+
+
+def recognition_response(results, elapsed_ms=None):
+    response = {
+        'status': 'done',
+        'recognized': [{'student_id': student_id, 'confidence': confidence}
+                       for student_id, confidence in best_matches(results).items()],
+        'frames': results,
+    }
+    if elapsed_ms is not None:
+        response['elapsed_ms'] = round(elapsed_ms, 1)
+        response['ms_per_frame'] = round(elapsed_ms / len(results), 1)
+    return response
 
 
 # Login route
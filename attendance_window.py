@@ -0,0 +1,43 @@
+import os
+import threading
+import time
+
+
+# Seconds a recorded (person, classroom, session) stays in memory; repeats inside the window skip the database
+ATTENDANCE_WINDOW = float(os.environ.get('SASC_ATTENDANCE_WINDOW', 3600))
+
+
+class RecentAttendance:
+    """In-process TTL set of attendance already written, so kiosk retries and tracker re-fires are
+    answered without recognition or a database round trip. The unique keys on the attendance table
+    (migrations/001_unique_attendance.sql) are what keeps other processes from writing duplicates."""
+
+    def __init__(self, ttl=ATTENDANCE_WINDOW):
+        self.ttl = ttl
+        self._expiry = {}
+        self._lock = threading.Lock()
+
+    def _purge(self, now):
+        for key in [key for key, expires in self._expiry.items() if expires <= now]:
+            del self._expiry[key]
+
+    def seen(self, key):
+        now = time.monotonic()
+        with self._lock:
+            expires = self._expiry.get(key)
+            return expires is not None and expires > now
+
+    def add(self, *keys):
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            for key in keys:
+                self._expiry[key] = now + self.ttl
+
+
+recent_attendance = RecentAttendance()
+
+
+# Key for one person's attendance in one class session; a session is a classroom on a given day
+def attendance_key(role, person_id, classroom_id, session_date):
+    return role, str(person_id), int(classroom_id), session_date
@@ -0,0 +1,256 @@
+"""Benchmark the face pipeline stage by stage on a synthetic faces/ tree.
+
+Each scale point (number of students) runs in a fresh process inside its own temporary
+directory, so model caches and label registries never leak between runs. Results are
+written as JSON for tracking regressions across versions.
+
+    python benchmarks/bench_pipeline.py --students 100,1000 --images 25 --output bench.json
+    python benchmarks/bench_pipeline.py --students 100 --video hallway.mp4 --recognizer nn
+    python benchmarks/bench_pipeline.py --students 1000 --storage float32,float16,uint8 --prototypes 0,5
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+def summarize(samples_ms):
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    if not len(samples):
+        return {'count': 0}
+    return {
+        'count': int(len(samples)),
+        'mean_ms': round(float(samples.mean()), 4),
+        'p50_ms': round(float(np.percentile(samples, 50)), 4),
+        'p95_ms': round(float(np.percentile(samples, 95)), 4),
+        'p99_ms': round(float(np.percentile(samples, 99)), 4),
+    }
+
+
+def timed_calls(fn, inputs):
+    samples = []
+    for item in inputs:
+        start = time.perf_counter()
+        fn(item)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+# A smooth random pattern per student stands in for a face; images of one student vary by shift and noise
+def synthetic_face(base, rng):
+    dy, dx = rng.integers(-3, 4, size=2)
+    face = np.roll(base, (dy, dx), axis=(0, 1)).astype(np.int16)
+    face += rng.normal(0, 8, base.shape).astype(np.int16)
+    return np.clip(face, 0, 255).astype(np.uint8)
+
+
+def student_base(rng):
+    coarse = rng.random((8, 8)).astype(np.float32)
+    return (cv2.resize(coarse, (100, 100), interpolation=cv2.INTER_CUBIC).clip(0, 1) * 255).astype(np.uint8)
+
+
+def generate_faces_tree(faces_dir, students, images, seed=0):
+    rng = np.random.default_rng(seed)
+    bases = {}
+    for s in range(students):
+        student_id = f's{s:06d}'
+        bases[student_id] = student_base(rng)
+        user_dir = f'{faces_dir}/{student_id}'
+        os.makedirs(user_dir, exist_ok=True)
+        for n in range(1, images + 1):
+            cv2.imwrite(f'{user_dir}/{student_id}_{n}.jpg', synthetic_face(bases[student_id], rng))
+    return bases
+
+
+def load_frames(frames_dir=None, video=None, limit=200, seed=0):
+    frames = []
+    if frames_dir:
+        for name in sorted(os.listdir(frames_dir))[:limit]:
+            frame = cv2.imread(os.path.join(frames_dir, name))
+            if frame is not None:
+                frames.append(frame)
+    if video:
+        cap = cv2.VideoCapture(video)
+        while len(frames) < limit:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+    if not frames:
+        # No recordings given: time the detector's full scan over face-free 640x480 frames
+        rng = np.random.default_rng(seed)
+        frames = [rng.integers(0, 255, (480, 640, 3), dtype=np.uint8) for _ in range(min(limit, 50))]
+    return frames
+
+
+# Memory and accuracy of compact nn models (quantized storage, k-means prototypes) trained on the same
+# samples; agreement is measured against the full-precision float32 model with every sample kept
+def compare_compact_models(student_ids, queries, query_ids, storages, prototype_counts):
+    from face_loader import load_training_set
+    from nn_recognizer import NearestNeighbourRecognizer
+
+    student_labels = {student_id: label for label, student_id in student_ids.items()}
+    faces, labels = load_training_set('faces', student_labels)
+    expected = np.array([student_labels[student_id] for student_id in query_ids])
+    batch = np.stack(queries)
+
+    variants = []
+    reference = None
+    for storage, prototypes in [('float32', 0)] + [(storage, count) for storage in storages for count in prototype_counts
+                                                   if (storage, count) != ('float32', 0)]:
+        recognizer = NearestNeighbourRecognizer(storage=storage, prototypes=prototypes)
+        start = time.perf_counter()
+        recognizer.train(faces, np.asarray(labels))
+        train_s = time.perf_counter() - start
+        predicted, confidences = recognizer.predict_batch(batch)
+        if reference is None:
+            reference = predicted[:, 0]
+        variants.append({
+            'storage': storage,
+            'prototypes': prototypes,
+            'samples_stored': int(recognizer.labels.shape[0]),
+            'model_bytes': recognizer.memory_bytes(),
+            'train_s': round(train_s, 3),
+            'predict': summarize(timed_calls(recognizer.predict, queries)),
+            'top1_accuracy': round(float(np.mean(predicted[:, 0] == expected)), 4),
+            'agreement_with_full': round(float(np.mean(predicted[:, 0] == reference)), 4),
+        })
+    return variants
+
+
+# One scale point, run in a fresh process with its working directory set to a scratch tree
+def run_scale_point(config):
+    os.chdir(config['workdir'])
+    os.environ['SASC_RECOGNIZER'] = config['recognizer']
+    import function
+    import model_store
+    from detectors import thread_detector
+
+    results = {'students': config['students'], 'images_per_student': config['images']}
+    rng = np.random.default_rng(config['seed'])
+
+    start = time.perf_counter()
+    bases = generate_faces_tree('faces', config['students'], config['images'], config['seed'])
+    results['generate_s'] = round(time.perf_counter() - start, 3)
+
+    crops = [rng.integers(0, 255, (int(size), int(size), 3), dtype=np.uint8)
+             for size in rng.integers(80, 240, size=config['queries'])]
+    results['preprocess_face'] = summarize(timed_calls(function.preprocess_face, crops))
+
+    start = time.perf_counter()
+    recognizer, student_ids = function.load_student_faces()
+    results['train_cold_s'] = round(time.perf_counter() - start, 3)
+    results['model_bytes'] = recognizer.memory_bytes()
+
+    # Reload from the model store as a freshly started process would
+    model_store._cached = None
+    start = time.perf_counter()
+    function.load_student_faces()
+    results['load_stored_s'] = round(time.perf_counter() - start, 3)
+
+    label_of = {student_id: label for label, student_id in student_ids.items()}
+    query_ids = rng.choice(list(bases), size=config['queries'])
+    queries = [function.preprocess_face(synthetic_face(bases[student_id], rng)) for student_id in query_ids]
+    predictions = []
+    results['predict'] = summarize(timed_calls(lambda face: predictions.append(recognizer.predict(face)), queries))
+    threshold = function.match_threshold(recognizer)
+    results['predict']['top1_accuracy'] = round(float(np.mean(
+        [label == label_of[student_id] for (label, _), student_id in zip(predictions, query_ids)])), 4)
+    results['predict']['accepted_rate'] = round(float(np.mean(
+        [confidence < threshold for _, confidence in predictions])), 4)
+
+    if hasattr(recognizer, 'predict_batch'):
+        start = time.perf_counter()
+        recognizer.predict_batch(np.stack(queries))
+        results['predict_batch_ms_per_crop'] = round((time.perf_counter() - start) * 1000 / len(queries), 4)
+
+    if config.get('storage'):
+        results['compact_models'] = compare_compact_models(student_ids, queries, query_ids, config['storage'],
+                                                           config['prototypes'])
+
+    frames = load_frames(config.get('frames_dir'), config.get('video'), seed=config['seed'])
+    face_counts = []
+    results['detect'] = summarize(timed_calls(lambda frame: face_counts.append(len(thread_detector().detect(frame))),
+                                              frames))
+    results['detect']['faces_found'] = int(sum(face_counts))
+    results['detect']['frame_shape'] = list(frames[0].shape)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', default='100', help='comma-separated scale points, e.g. 100,1000,10000')
+    parser.add_argument('--images', type=int, default=25, help='images per student')
+    parser.add_argument('--queries', type=int, default=200, help='crops timed for preprocess/predict')
+    parser.add_argument('--recognizer', default=os.environ.get('SASC_RECOGNIZER', 'nn'), choices=['lbph', 'nn'])
+    parser.add_argument('--frames-dir', help='directory of stored frames for the detection stage')
+    parser.add_argument('--video', help='video file for the detection stage')
+    parser.add_argument('--storage', help='compare compact nn models, e.g. float32,float16,uint8')
+    parser.add_argument('--prototypes', default='0', help='k-means prototypes per student for --storage, e.g. 0,5')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    args = parser.parse_args(argv)
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+        'recognizer': args.recognizer,
+        'scale_points': [],
+    }
+
+    context = multiprocessing.get_context('spawn')
+    for students in [int(value) for value in args.students.split(',')]:
+        with tempfile.TemporaryDirectory(prefix='sasc-bench-') as workdir:
+            config = {
+                'workdir': workdir, 'students': students, 'images': args.images, 'queries': args.queries,
+                'recognizer': args.recognizer, 'seed': args.seed,
+                'storage': args.storage.split(',') if args.storage else None,
+                'prototypes': [int(value) for value in args.prototypes.split(',')],
+                'frames_dir': os.path.abspath(args.frames_dir) if args.frames_dir else None,
+                'video': os.path.abspath(args.video) if args.video else None,
+            }
+            with context.Pool(1) as pool:
+                result = pool.apply(run_scale_point, (config,))
+            report['scale_points'].append(result)
+            print(f"{students} students: train {result['train_cold_s']}s, "
+                  f"predict p50 {result['predict'].get('p50_ms')}ms", file=sys.stderr)
+            for variant in result.get('compact_models', []):
+                print(f"  {variant['storage']}/{variant['prototypes'] or 'all'}: {variant['model_bytes'] / 2**20:.1f} MiB, "
+                      f"top-1 {variant['top1_accuracy']}, agrees {variant['agreement_with_full']}", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""Concurrent ingestion from any number of cameras into a fixed-size recognition pool.
+
+Each source (device index, video file, or MJPEG/RTSP URL) gets a reader thread that keeps only its
+newest frames. A dispatcher hands each camera's latest frame to a shared worker pool, at most one in
+flight per camera, so total CPU is set by the pool size however many cameras are attached and slow
+recognition drops stale frames instead of queueing them.
+
+    python cameras.py 0 doorway.mp4 http://127.0.0.1:8081/stream.mjpg --workers 2
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from metrics import timed
+from motion import MotionGate
+
+
+logger = logging.getLogger(__name__)
+
+# Frames a reader keeps; older ones are overwritten, never queued
+FRAME_BUFFER = int(os.environ.get('SASC_FRAME_BUFFER', 2))
+# Detection/recognition threads shared by all cameras
+CAMERA_WORKERS = int(os.environ.get('SASC_CAMERA_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+# Seconds between attempts to reopen a device or stream that stopped delivering frames
+RECONNECT_DELAY = 2.0
+# Camera used by the enrollment and check-in routines, and how many recent frames it keeps
+CAMERA_SOURCE = os.environ.get('SASC_CAMERA_SOURCE', '0')
+CAMERA_RING_SIZE = int(os.environ.get('SASC_CAMERA_RING_SIZE', 8))
+
+
+# '0' -> device 0, anything else is a file path or URL handed to VideoCapture as is
+def parse_source(spec):
+    return int(spec) if str(spec).isdigit() else spec
+
+
+def _is_file(source):
+    return isinstance(source, str) and os.path.isfile(source)
+
+
+class CameraReader:
+    """Reads one source on its own thread into a small ring of the newest frames."""
+
+    def __init__(self, source, name=None, buffer_size=FRAME_BUFFER, loop=False):
+        self.source = parse_source(source)
+        self.name = name or str(source)
+        self.loop = loop
+        self.frames = deque(maxlen=buffer_size)
+        self.sequence = 0       # Frames read so far; lets consumers tell a new frame from one already seen
+        self.dropped = 0        # Frames overwritten before anyone took them
+        self.finished = False   # Video file played out (and not looping)
+        self._taken = 0
+        self._lock = threading.Lock()
+        self._new_frame = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'camera-{self.name}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+    def _open(self):
+        with timed('camera_open', camera=self.name):
+            cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            cap.release()
+            return None
+        return cap
+
+    def _run(self):
+        replay = _is_file(self.source)
+        while not self._stop.is_set():
+            cap = self._open()
+            if cap is None:
+                logger.warning('Camera %s unavailable, retrying in %ss', self.name, RECONNECT_DELAY)
+                self._stop.wait(RECONNECT_DELAY)
+                continue
+
+            # Files are paced at their own frame rate so replays behave like a live camera
+            interval = 1.0 / (cap.get(cv2.CAP_PROP_FPS) or 25) if replay else 0
+            next_frame_at = time.monotonic()
+            while not self._stop.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                self._push(frame)
+                if interval:
+                    next_frame_at += interval
+                    self._stop.wait(max(0.0, next_frame_at - time.monotonic()))
+            cap.release()
+
+            if replay and not self.loop:
+                with self._new_frame:
+                    self.finished = True
+                    self._new_frame.notify_all()
+                return
+            if not replay:
+                self._stop.wait(RECONNECT_DELAY)
+
+    def _push(self, frame):
+        with self._lock:
+            if self.frames and self._taken < self.sequence:
+                self.dropped += 1  # The previous newest frame was superseded before anyone took it
+            self.frames.append(frame)
+            self.sequence += 1
+            self._new_frame.notify_all()
+
+    # Newest frame newer than after_sequence and its sequence number, waiting up to timeout seconds
+    # for one to arrive; (None, sequence) if none did. Frames are shared, copy before drawing on them
+    def read(self, after_sequence=0, timeout=0):
+        with self._new_frame:
+            self._new_frame.wait_for(lambda: self.sequence > after_sequence or self.finished, timeout)
+            if self.sequence <= after_sequence:
+                return None, self.sequence
+            self._taken = self.sequence
+            return self.frames[-1], self.sequence
+
+    # Every frame still in the ring, oldest first
+    def recent(self):
+        with self._lock:
+            return list(self.frames)
+
+
+class CameraHub:
+    """Feeds the newest frame of every camera to one bounded pool of recognition workers.
+
+    process(camera_name, frame) runs on a pool thread and its return value is passed to
+    on_result(camera_name, result). OpenCV releases the GIL in detection and prediction, so the
+    threads run in parallel; cv2's own threading is capped to match so the pool size is the limit.
+    """
+
+    def __init__(self, sources, process, on_result=None, workers=CAMERA_WORKERS, loop=False):
+        # The same source may be listed twice (e.g. a file replayed as two doorways); names must differ
+        names = [str(source) if list(sources).count(source) == 1 else f'{source}#{i}' for i, source in enumerate(sources)]
+        self.readers = [CameraReader(source, name, loop=loop) for source, name in zip(sources, names)]
+        self.process = process
+        self.on_result = on_result or (lambda camera, result: None)
+        self.workers = workers
+        self.processed = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='recognize')
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._dispatcher = threading.Thread(target=self._dispatch, name='camera-dispatch', daemon=True)
+
+    def start(self):
+        cv2.setNumThreads(self.workers)
+        for reader in self.readers:
+            reader.start()
+        self._dispatcher.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._dispatcher.join(timeout=5)
+        for reader in self.readers:
+            reader.stop()
+        self._pool.shutdown(wait=True)
+
+    # Every source is a file that has played out and the last frames have been processed
+    def finished(self):
+        with self._lock:
+            idle = not self._in_flight
+        return idle and all(reader.finished and reader.sequence == reader._taken for reader in self.readers)
+
+    def _dispatch(self):
+        last_sequence = {reader.name: 0 for reader in self.readers}
+        while not self._stop.is_set():
+            submitted = False
+            for reader in self.readers:
+                with self._lock:
+                    if reader.name in self._in_flight:
+                        continue
+                frame, sequence = reader.read(last_sequence[reader.name])
+                if frame is None:
+                    continue
+                last_sequence[reader.name] = sequence
+                with self._lock:
+                    self._in_flight.add(reader.name)
+                self._pool.submit(self._work, reader.name, frame)
+                submitted = True
+            if not submitted:
+                self._stop.wait(0.005)
+
+    def _work(self, camera, frame):
+        try:
+            self.on_result(camera, self.process(camera, frame))
+        except Exception:
+            logger.exception('Processing a frame from %s failed', camera)
+        finally:
+            with self._lock:
+                self._in_flight.discard(camera)
+                self.processed += 1
+
+    def stats(self):
+        return {reader.name: {'read': reader.sequence, 'dropped': reader.dropped, 'finished': reader.finished}
+                for reader in self.readers}
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+# Camera opened once per process and kept grabbing, so check-ins skip device open and exposure
+# settling; the first call for a source starts it, later calls share the same reader
+def shared_camera(source=CAMERA_SOURCE):
+    with _shared_lock:
+        reader = _shared.get(str(source))
+        if reader is None:
+            reader = _shared[str(source)] = CameraReader(source, buffer_size=CAMERA_RING_SIZE).start()
+        return reader
+
+
+_motion_gates = {}
+
+
+# Pool task: recognize everyone in one frame with whichever model is live right now. Each camera has
+# its own motion gate (the hub keeps one frame per camera in flight, so gates are never shared), and
+# frames where nothing changed skip detection altogether
+def recognize_camera_frame(camera, frame):
+    import function
+
+    gate = _motion_gates.get(camera)
+    if gate is None:
+        gate = _motion_gates[camera] = MotionGate()
+    region = gate.changed_region(frame)
+    if region is None:
+        return {'idle': True, 'faces': []}
+
+    recognizer, student_ids = function.current_model()
+    return function.recognize_frame(recognizer, student_ids, frame, source='camera', region=region)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sources', nargs='+', help='device index, video file or stream URL')
+    parser.add_argument('--workers', type=int, default=CAMERA_WORKERS, help='recognition threads shared by all cameras')
+    parser.add_argument('--loop', action='store_true', help='replay video files forever')
+    parser.add_argument('--duration', type=float, default=0, help='stop after this many seconds (0 = until files end)')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    def report(camera, result):
+        students = sorted({face['student_id'] for face in result['faces'] if face['student_id'] is not None})
+        if students:
+            logger.info('%s: %s', camera, ', '.join(students))
+
+    hub = CameraHub(args.sources, recognize_camera_frame, report, workers=args.workers, loop=args.loop).start()
+    started = time.monotonic()
+    try:
+        while not (args.duration and time.monotonic() - started > args.duration):
+            if not args.loop and hub.finished():
+                break
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        pass
+    hub.stop()
+    logger.info('Processed %s frames in %.1fs: %s', hub.processed, time.monotonic() - started, hub.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+CLASSROOM_CACHE_SIZE = int(os.environ.get('SASC_CLASSROOM_CACHE_SIZE', 32))
+
+
+class ClassroomModelCache:
+    """Bounded LRU of per-classroom recognizers.
+
+    An entry is reused only while both the classroom's roster and the model generation it was
+    built from are unchanged, so a roster edit in another worker process is still picked up.
+    """
+
+    def __init__(self, max_size=CLASSROOM_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Cached (recognizer, allowed_labels) for a classroom, calling build() on a miss
+    def get(self, classroom_id, roster, generation, build):
+        roster = frozenset(roster)
+        with self._lock:
+            entry = self._entries.get(classroom_id)
+            if entry is not None and entry[0] == roster and entry[1] == generation:
+                self._entries.move_to_end(classroom_id)
+                return entry[2]
+
+        # Built outside the lock, training a classroom subset can take a while
+        model = build(roster)
+        with self._lock:
+            self._entries[classroom_id] = (roster, generation, model)
+            self._entries.move_to_end(classroom_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return model
+
+    def invalidate(self, classroom_id=None):
+        with self._lock:
+            if classroom_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(classroom_id, None)
+
+
+classroom_models = ClassroomModelCache()
@@ -0,0 +1,123 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+
+
+# Which detector to use and how wide the downscaled detection copy is; both set through the environment
+DETECTOR_BACKEND = os.environ.get('SASC_FACE_DETECTOR', 'haar')
+DETECTION_WIDTH = int(os.environ.get('SASC_DETECTION_WIDTH', 320))
+
+HAAR_CASCADE_PATH = os.environ.get('SASC_HAAR_CASCADE',
+                                   cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+# The pip OpenCV wheels only ship Haar cascades; the LBP cascade and the res10 SSD come from the OpenCV repo
+LBP_CASCADE_PATH = os.environ.get('SASC_LBP_CASCADE', 'models/lbpcascade_frontalface_improved.xml')
+DNN_PROTOTXT_PATH = os.environ.get('SASC_DNN_PROTOTXT', 'models/deploy.prototxt')
+DNN_MODEL_PATH = os.environ.get('SASC_DNN_MODEL', 'models/res10_300x300_ssd_iter_140000.caffemodel')
+
+
+class FaceDetector:
+    """Detects faces on a downscaled copy of the frame and returns (x, y, w, h) boxes in original coordinates."""
+
+    def __init__(self, detection_width=DETECTION_WIDTH):
+        # 0 disables downscaling
+        self.detection_width = detection_width
+
+    def detect(self, frame):
+        height, width = frame.shape[:2]
+        scale = 1.0
+        if self.detection_width and width > self.detection_width:
+            scale = self.detection_width / width
+            frame = cv2.resize(frame, (self.detection_width, max(1, round(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+
+        boxes = []
+        for (x, y, w, h) in self._detect(frame):
+            boxes.append((int(x / scale), int(y / scale), int(w / scale), int(h / scale)))
+        return boxes
+
+    def _detect(self, image):
+        raise NotImplementedError
+
+
+class CascadeDetector(FaceDetector):
+    def __init__(self, cascade_path, detection_width=DETECTION_WIDTH, scale_factor=1.3, min_neighbors=5):
+        super().__init__(detection_width)
+        self.cascade = cv2.CascadeClassifier(cascade_path)
+        # A missing or unreadable file still yields a classifier, one that fails every detect() call
+        if self.cascade.empty():
+            raise ValueError(f"Could not load face detection cascade '{cascade_path}'")
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+
+    def _detect(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        return self.cascade.detectMultiScale(gray, scaleFactor=self.scale_factor, minNeighbors=self.min_neighbors)
+
+
+class HaarDetector(CascadeDetector):
+    def __init__(self, detection_width=DETECTION_WIDTH):
+        super().__init__(HAAR_CASCADE_PATH, detection_width)
+
+
+class LbpDetector(CascadeDetector):
+    """LBP cascade: a few times faster than Haar at similar recall on frontal faces."""
+
+    def __init__(self, detection_width=DETECTION_WIDTH):
+        super().__init__(LBP_CASCADE_PATH, detection_width, scale_factor=1.2)
+
+
+class DnnDetector(FaceDetector):
+    """OpenCV DNN res10 SSD face detector on the CPU backend."""
+
+    def __init__(self, detection_width=DETECTION_WIDTH, confidence_threshold=0.5):
+        super().__init__(detection_width)
+        self.net = cv2.dnn.readNetFromCaffe(DNN_PROTOTXT_PATH, DNN_MODEL_PATH)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.confidence_threshold = confidence_threshold
+
+    def _detect(self, image):
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        height, width = image.shape[:2]
+        blob = cv2.dnn.blobFromImage(image, 1.0, (300, 300), (104.0, 177.0, 123.0))
+        self.net.setInput(blob)
+        detections = self.net.forward()[0, 0]
+
+        boxes = []
+        for detection in detections[detections[:, 2] >= self.confidence_threshold]:
+            x1, y1, x2, y2 = np.clip(detection[3:7], 0.0, 1.0) * [width, height, width, height]
+            if x2 > x1 and y2 > y1:
+                boxes.append((x1, y1, x2 - x1, y2 - y1))
+        return boxes
+
+
+BACKENDS = {
+    'haar': HaarDetector,
+    'lbp': LbpDetector,
+    'dnn': DnnDetector,
+}
+
+
+# Build the configured detector (SASC_FACE_DETECTOR=haar|lbp|dnn)
+def create_detector(backend=None, detection_width=DETECTION_WIDTH):
+    backend = backend or DETECTOR_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown face detector '{backend}', expected one of: {', '.join(BACKENDS)}")
+    return BACKENDS[backend](detection_width)
+
+
+_local = threading.local()
+
+
+# The configured detector for the calling thread. Cascades and DNN nets keep per-call state on the
+# object, so concurrent detect() calls on one instance return each other's boxes; every thread that
+# detects builds its own, once per detection width
+def thread_detector(detection_width=DETECTION_WIDTH):
+    detectors = _local.__dict__.setdefault('detectors', {})
+    detector = detectors.get(detection_width)
+    if detector is None:
+        detector = detectors[detection_width] = create_detector(detection_width=detection_width)
+    return detector
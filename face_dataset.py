@@ -0,0 +1,133 @@
+import json
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from face_loader import FACE_SIZE, load_training_set
+from file_lock import file_lock
+from label_registry import labels_for
+
+
+# Packed training set: every 100x100 preprocessed crop in one contiguous uint8 file,
+# a parallel int32 label file and a JSON index of sample ranges per student
+DATASET_DIR = os.environ.get('SASC_DATASET_DIR', 'dataset')
+FACES_PATH = f'{DATASET_DIR}/faces.u8'
+LABELS_PATH = f'{DATASET_DIR}/labels.i32'
+INDEX_PATH = f'{DATASET_DIR}/index.json'
+
+FACE_BYTES = FACE_SIZE[0] * FACE_SIZE[1]
+
+_lock = threading.Lock()
+
+
+# Held around every write, so appends from web workers and the recognition service can't interleave
+# their read-index, truncate, append and write-index steps
+@contextmanager
+def _write_lock():
+    with _lock, file_lock(f'{DATASET_DIR}/write.lock'):
+        yield
+
+
+def dataset_exists():
+    return os.path.exists(INDEX_PATH)
+
+
+def _read_index():
+    with open(INDEX_PATH) as f:
+        return json.load(f)
+
+
+def _write_index(index):
+    tmp_path = f'{INDEX_PATH}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, INDEX_PATH)
+
+
+# Changes whenever samples are appended, used to key the stored model like faces_fingerprint()
+def dataset_fingerprint():
+    index = _read_index()
+    return f"dataset-{index['count']}-{os.stat(FACES_PATH).st_mtime_ns}"
+
+
+# Map the dataset read-only; the index count is authoritative, so a half-finished append is ignored
+def open_dataset():
+    index = _read_index()
+    count = index['count']
+    if count == 0:
+        return np.empty((0,) + FACE_SIZE, dtype=np.uint8), np.empty(0, dtype=np.int32), index
+
+    faces = np.memmap(FACES_PATH, dtype=np.uint8, mode='r', shape=(count,) + FACE_SIZE)
+    labels = np.memmap(LABELS_PATH, dtype=np.int32, mode='r', shape=(count,))
+    return faces, labels, index
+
+
+# Zero-copy views of one student's crops
+def student_samples(student_id):
+    faces, _, index = open_dataset()
+    return [faces[offset:offset + count] for offset, count in index['students'].get(str(student_id), [])]
+
+
+# Append preprocessed 100x100 crops for one student and record their range in the index
+def append_samples(student_id, label, face_images):
+    if not face_images:
+        return
+
+    crops = np.ascontiguousarray(np.stack(face_images), dtype=np.uint8)
+    if crops.shape[1:] != FACE_SIZE:
+        raise ValueError(f'Expected {FACE_SIZE[0]}x{FACE_SIZE[1]} crops, got {crops.shape[1:]}')
+
+    with _write_lock():
+        index = _read_index() if dataset_exists() else {'count': 0, 'students': {}}
+        offset = index['count']
+
+        # Trim bytes left behind by an append that died before its index update
+        for path, item_bytes in ((FACES_PATH, FACE_BYTES), (LABELS_PATH, 4)):
+            with open(path, 'ab') as f:
+                f.truncate(offset * item_bytes)
+
+        with open(FACES_PATH, 'ab') as f:
+            f.write(crops.tobytes())
+        with open(LABELS_PATH, 'ab') as f:
+            f.write(np.full(len(crops), label, dtype=np.int32).tobytes())
+
+        index['students'].setdefault(str(student_id), []).append([offset, len(crops)])
+        index['count'] = offset + len(crops)
+        _write_index(index)
+
+
+# One-shot conversion of an existing faces/<id>/*.jpg tree into the packed format
+def convert_faces_tree(faces_dir='faces'):
+    student_dirs = sorted(name for name in os.listdir(faces_dir) if os.path.isdir(f'{faces_dir}/{name}'))
+    student_labels = labels_for(student_dirs)
+    faces, labels = load_training_set(faces_dir, student_labels)
+
+    label_students = {label: student_id for student_id, label in student_labels.items()}
+
+    # Samples come back grouped per student, so each run of equal labels is one index range
+    index = {'count': len(faces), 'students': {}}
+    run_start = 0
+    for i in range(1, len(labels) + 1):
+        if i == len(labels) or labels[i] != labels[run_start]:
+            student_id = label_students[int(labels[run_start])]
+            index['students'].setdefault(student_id, []).append([run_start, i - run_start])
+            run_start = i
+
+    with _write_lock():
+        with open(FACES_PATH, 'wb') as f:
+            for face in faces:
+                f.write(np.ascontiguousarray(face, dtype=np.uint8).tobytes())
+        with open(LABELS_PATH, 'wb') as f:
+            f.write(np.asarray(labels, dtype=np.int32).tobytes())
+        _write_index(index)
+
+    return len(faces)
+
+
+if __name__ == '__main__':
+    source = sys.argv[1] if len(sys.argv) > 1 else 'faces'
+    converted = convert_faces_tree(source)
+    print(f'Packed {converted} face images from {source}/ into {DATASET_DIR}/')
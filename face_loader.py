@@ -0,0 +1,79 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# Every stored crop is this size; the recognizers and the packed dataset import it from here
+FACE_SIZE = (100, 100)
+CHUNK_SIZE = int(os.environ.get('SASC_LOADER_CHUNK_SIZE', 256))
+# Below this many images the pool start-up costs more than it saves
+MIN_PARALLEL_IMAGES = int(os.environ.get('SASC_LOADER_MIN_PARALLEL', 1000))
+# Workers are started fresh rather than forked: the caller is a threaded web or camera process,
+# and a fork would copy its held locks and camera threads' state into every worker
+POOL_CONTEXT = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+# Pool worker setup: one OpenCV thread per worker, the pool already uses every core. Only ever run in
+# the workers, so the serial path leaves the calling process's own OpenCV threading alone
+def _init_worker():
+    cv2.setNumThreads(1)
+
+
+# Decode and normalize one chunk of stored samples, in a pool worker or the calling process
+def _load_chunk(chunk):
+    faces, labels = [], []
+    for img_path, label in chunk:
+        # Loaded straight to grayscale, so no BGR2GRAY conversion is needed
+        img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            continue
+        img = cv2.equalizeHist(img)
+        if img.shape != FACE_SIZE:  # Crops saved by capture_face are already 100x100
+            img = cv2.resize(img, FACE_SIZE)
+        faces.append(img)
+        labels.append(label)
+
+    if not faces:
+        return np.empty((0,) + FACE_SIZE, dtype=np.uint8), np.empty(0, dtype=np.int32)
+    return np.stack(faces), np.array(labels, dtype=np.int32)
+
+
+# List every (image path, label) pair under faces_dir
+def list_samples(faces_dir, student_labels):
+    samples = []
+    for student_id, label in student_labels.items():
+        user_dir = f'{faces_dir}/{student_id}'
+        for img_file in sorted(os.listdir(user_dir)):
+            samples.append((f'{user_dir}/{img_file}', label))
+    return samples
+
+
+# Load and preprocess the whole training set, spreading chunks of files over a process pool
+def load_training_set(faces_dir, student_labels, workers=None):
+    start = time.perf_counter()
+    samples = list_samples(faces_dir, student_labels)
+    chunks = [samples[i:i + CHUNK_SIZE] for i in range(0, len(samples), CHUNK_SIZE)]
+    workers = workers or os.cpu_count() or 1
+
+    if workers > 1 and len(samples) >= MIN_PARALLEL_IMAGES:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), initializer=_init_worker,
+                                 mp_context=multiprocessing.get_context(POOL_CONTEXT)) as pool:
+            results = list(pool.map(_load_chunk, chunks))
+    else:
+        workers = 1
+        results = [_load_chunk(chunk) for chunk in chunks]
+
+    faces = [face for chunk_faces, _ in results for face in chunk_faces]
+    labels = np.concatenate([chunk_labels for _, chunk_labels in results]) if results else np.empty(0, dtype=np.int32)
+
+    elapsed = time.perf_counter() - start
+    logger.info('Loaded %d face images with %d worker(s) in %.2fs (%.0f images/s)',
+                len(faces), workers, elapsed, len(faces) / elapsed if elapsed else 0.0)
+    return faces, labels
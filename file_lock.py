@@ -0,0 +1,24 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, only callers' own thread locks apply
+    fcntl = None
+
+
+# Exclusive advisory lock on path, shared by every process and thread that opens it; the directory
+# holding the lock file is created first, callers may rely on it existing
+@contextmanager
+def file_lock(path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+
+    with open(path, 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -1,117 +1,621 @@
 import cv2
 import numpy as np
-from flask import flash
+from flask import flash, has_request_context
+import logging
 import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+from model_store import (combine_fingerprints, create_recognizer, faces_fingerprint, files_fingerprint, load_model,
+                         save_model, stored_fingerprint, training_lock)
+from model_manager import ModelManager
+from label_registry import label_for, labels_for
+from face_loader import FACE_SIZE, load_training_set
+import face_dataset
+from detectors import thread_detector
+from tracker import FaceTracker
+from classroom_cache import classroom_models
+import quality
+from cameras import shared_camera
+from motion import MotionGate
+from metrics import count_label, size_label, timed
 
 
-# Initialize the Haar Cascade
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+logger = logging.getLogger(__name__)
+
+
+# Flash inside a request, log otherwise (recognition worker processes and background threads)
+def notify(message, category):
+    if has_request_context():
+        flash(message, category)
+    else:
+        logger.log({'error': logging.ERROR, 'warning': logging.WARNING}.get(category, logging.INFO), message)
+
+# Face detection uses the backend chosen by SASC_FACE_DETECTOR (haar, lbp or dnn) on a downscaled copy of
+# each frame. Detectors are not thread-safe, so every call site takes the calling thread's own from
+# thread_detector(): request threads, camera pool threads and recognition service threads all detect at once
+# Lecture hall frames hold many small faces, so whole-class capture detects at full resolution
+CLASSROOM_DETECTION_WIDTH = 0
+
+# Lecture hall faces are far from the camera, so whole-class capture accepts smaller crops
+CLASSROOM_MIN_FACE_SIZE = 30
+# Seconds to wait for the camera service to deliver a frame before giving up
+CAMERA_TIMEOUT = float(os.environ.get('SASC_CAMERA_TIMEOUT', 5))
+# While nothing moves in front of the kiosk, look at a frame only this often (seconds)
+MOTION_IDLE_INTERVAL = float(os.environ.get('SASC_MOTION_IDLE_INTERVAL', 0.2))
+
+# Samples collected per student by capture_face, written to disk in batches of CAPTURE_WRITE_BATCH
+SAMPLES_PER_STUDENT = 25
+CAPTURE_WRITE_BATCH = 5
+# Capture stops after this many seconds even if fewer diverse samples were found
+CAPTURE_TIMEOUT = float(os.environ.get('SASC_CAPTURE_TIMEOUT', 20))
+# Skip the OpenCV preview window during capture, for servers without a display
+HEADLESS = os.environ.get('SASC_HEADLESS', '0') == '1'
+
+# Burst enrollment decodes and detects frames on a thread pool; OpenCV releases the GIL while it works
+ENROLL_THREADS = int(os.environ.get('SASC_ENROLL_THREADS', os.cpu_count() or 1))
+_enroll_pool = ThreadPoolExecutor(max_workers=ENROLL_THREADS)
+# Serializes sample writes and model updates so each enrollment lands as one unit
+_enroll_lock = threading.Lock()
+# Crops whose 64-bit difference hashes are closer than this many bits count as duplicates
+DUPLICATE_DISTANCE = int(os.environ.get('SASC_DUPLICATE_DISTANCE', 6))
+
+# LBPH distance below which a prediction counts as a match
+CONFIDENCE_THRESHOLD = 50
+
+
+# Match threshold for a recognizer; recognizers with their own distance scale carry a threshold attribute
+def match_threshold(recognizer):
+    return getattr(recognizer, 'threshold', CONFIDENCE_THRESHOLD)
 
 # Preprocessing helper function
 def preprocess_face(image):
-    # Convert to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    # Convert to grayscale (crops cut from an already grayscale frame skip this)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
     # Normalize lighting
     gray = cv2.equalizeHist(gray)
     # Resize to a consistent size (e.g., 100x100)
-    resized_face = cv2.resize(gray, (100, 100))
+    resized_face = cv2.resize(gray, FACE_SIZE)
     return resized_face
 
-# Function to capture face images for training
-def capture_face(user_id):
-    cap = cv2.VideoCapture(0)
-    face_count = 0
-    user_dir = f'faces/{user_id}'
+# Preprocess many crops into one contiguous (n, 100, 100) batch
+def preprocess_faces(face_imgs):
+    batch = np.empty((len(face_imgs),) + FACE_SIZE, dtype=np.uint8)
+    for i, face_img in enumerate(face_imgs):
+        batch[i] = preprocess_face(face_img)
+    return batch
 
-    if not os.path.exists(user_dir):
-        os.makedirs(user_dir)
+# Decode an uploaded image straight to grayscale, detection and LBPH never need colour. None if it
+# isn't an image; imdecode raises on an empty buffer rather than returning None
+def decode_gray(encoded_image):
+    if not encoded_image:
+        return None
+    try:
+        return cv2.imdecode(np.frombuffer(encoded_image, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    except cv2.error:
+        return None
 
-    while face_count < 25:  # Capture up to 25 images per student
-        ret, frame = cap.read()
-        if not ret:
-            flash('Error: Unable to access the camera.', 'error')
-            break
+# Detect the largest face in an uploaded image and return it cropped and preprocessed, or None
+def extract_face(encoded_image, check_quality=False):
+    gray = decode_gray(encoded_image)
+    if gray is None:
+        return None
 
-        faces = face_cascade.detectMultiScale(frame, scaleFactor=1.3, minNeighbors=5)
+    faces = thread_detector().detect(gray)
+    if not faces:
+        return None
+    x, y, w, h = max(faces, key=lambda box: box[2] * box[3])
+    face_img = gray[y:y + h, x:x + w]
+    if check_quality and quality.check_face(face_img):
+        return None
+    return preprocess_face(face_img)
 
-        for (x, y, w, h) in faces:
-            face_count += 1
-            face_img = frame[y:y+h, x:x+w]
-            processed_face = preprocess_face(face_img)
-            face_filename = f'{user_dir}/{user_id}_{face_count}.jpg'
-            cv2.imwrite(face_filename, processed_face)
+# 64-bit difference hash of a crop: one bit per horizontal brightness gradient on a 9x8 thumbnail
+def face_hash(face_img):
+    thumb = cv2.resize(face_img, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = np.packbits(thumb[:, 1:] > thumb[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
 
-            # Feedback on the frame
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-            cv2.putText(frame, f'Capturing {face_count}/25', (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+# True if the hash is within min_distance bits of any already kept hash
+def is_near_duplicate(face_bits, kept_hashes, min_distance=DUPLICATE_DISTANCE):
+    return any(bin(face_bits ^ other).count('1') < min_distance for other in kept_hashes)
 
-        cv2.imshow('Capturing Faces', frame)
+# Keep crops whose hash differs from every already kept one by at least min_distance bits
+def dedupe_faces(face_imgs, min_distance=DUPLICATE_DISTANCE):
+    kept, kept_hashes = [], []
+    for face_img in face_imgs:
+        face_bits = face_hash(face_img)
+        if not is_near_duplicate(face_bits, kept_hashes, min_distance):
+            kept.append(face_img)
+            kept_hashes.append(face_bits)
+    return kept
 
-        if cv2.waitKey(1) & 0xFF == ord('q') or face_count >= 25:
-            break
+# Enroll a burst of browser frames: detect and preprocess in parallel, drop near-duplicates,
+# then commit the survivors to the sample set and the live model in one step
+def enroll_burst(user_id, encoded_frames):
+    crops = [crop for crop in _enroll_pool.map(lambda frame: extract_face(frame, check_quality=True), encoded_frames)
+             if crop is not None]
+    kept = dedupe_faces(crops)
+    enroll_faces(user_id, kept)
+    return {'frames': len(encoded_frames), 'faces': len(crops), 'enrolled': len(kept)}
 
-    cap.release()
-    cv2.destroyAllWindows()
-    flash(f'{face_count} face images captured successfully for user {user_id}', 'success')
+# Put an item on a bounded queue, discarding the oldest entry if the consumer has fallen behind
+def _put_latest(q, item):
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
 
-# Load and train LBPH recognizer
-def load_student_faces():
-    recognizer = cv2.face.LBPHFaceRecognizer_create()
-    faces, labels = [], []
-    student_ids = {}
-
-    for student_id in os.listdir('faces'):
-        user_dir = f'faces/{student_id}'
-        for img_file in os.listdir(user_dir):
-            img_path = f'{user_dir}/{img_file}'
-            img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-            if img is None:
+# Capture stage 1: hand new camera frames to the detector, keeping only the newest if it lags
+def _capture_reader(camera, frames, done, status):
+    sequence = 0
+    while not done.is_set():
+        frame, sequence = camera.read(sequence, CAMERA_TIMEOUT)
+        if frame is None:
+            status['camera_error'] = True
+            done.set()
+            return
+        _put_latest(frames, frame)
+
+# Capture stage 2: quality gates, detection, preprocessing and near-duplicate rejection, so consecutive
+# frames of a motionless face count once; annotated previews go to the GUI if shown
+def _capture_detector(frames, samples, previews, done, status):
+    captured = 0
+    kept_hashes = []
+    try:
+        while not done.is_set():
+            try:
+                frame = frames.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            # Blurred, dark or washed-out frames are not worth detecting in, let alone saving
+            if quality.check_frame(frame):
+                faces = []
+            else:
+                with timed('detect', source='enroll') as labels:
+                    faces = thread_detector().detect(frame)
+                    labels['faces'] = count_label(len(faces))
+
+            preview = frame.copy() if previews is not None else None  # Ring buffer frames are shared
+            for (x, y, w, h) in faces:
+                face_img = frame[y:y+h, x:x+w]
+                if quality.check_face(face_img):
+                    continue
+                with timed('preprocess'):
+                    face_img = preprocess_face(face_img)
+                face_bits = face_hash(face_img)
+                if is_near_duplicate(face_bits, kept_hashes):
+                    status['duplicates'] += 1
+                    continue
+                kept_hashes.append(face_bits)
+                samples.put(face_img)
+                captured += 1
+
+                if preview is not None:
+                    cv2.rectangle(preview, (x, y), (x + w, y + h), (0, 255, 0), 2)
+                    cv2.putText(preview, f'Capturing {captured}/{SAMPLES_PER_STUDENT}', (x, y - 10),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+                if captured >= SAMPLES_PER_STUDENT:
+                    done.set()
+                    break
+
+            if preview is not None:
+                _put_latest(previews, preview)
+    finally:
+        samples.put(None)
+
+# Capture stage 3: write samples in batches, so JPEG encoding and disk latency never stall detection
+def _capture_writer(user_id, samples, status):
+    batch = []
+    while True:
+        sample = samples.get()
+        if sample is not None:
+            batch.append(sample)
+        if batch and (sample is None or len(batch) >= CAPTURE_WRITE_BATCH):
+            with timed('enroll', rows=len(batch)):
+                enroll_faces(user_id, batch)
+            status['saved'] += len(batch)
+            batch = []
+        if sample is None:
+            return
+
+# Function to capture face images for training: camera reader, detector and disk writer run as a
+# pipeline over bounded queues; headless mode skips the preview window and runs at camera frame rate
+def capture_face(user_id, headless=HEADLESS):
+    # The camera service keeps the device open between calls, so frames are available at once
+    camera = shared_camera()
+    frames = queue.Queue(maxsize=2)
+    samples = queue.Queue(maxsize=SAMPLES_PER_STUDENT)
+    previews = None if headless else queue.Queue(maxsize=2)
+    done = threading.Event()
+    status = {'saved': 0, 'duplicates': 0, 'camera_error': False}
+    deadline = time.monotonic() + CAPTURE_TIMEOUT
+
+    stages = [
+        threading.Thread(target=_capture_reader, args=(camera, frames, done, status), daemon=True),
+        threading.Thread(target=_capture_detector, args=(frames, samples, previews, done, status), daemon=True),
+        threading.Thread(target=_capture_writer, args=(user_id, samples, status), daemon=True),
+    ]
+    for stage in stages:
+        stage.start()
+
+    if headless:
+        done.wait(CAPTURE_TIMEOUT)
+    else:
+        # GUI calls stay on the calling thread; the window only ever shows the newest preview
+        while not done.is_set() and time.monotonic() < deadline:
+            try:
+                cv2.imshow('Capturing Faces', previews.get(timeout=0.1))
+            except queue.Empty:
                 continue
-            faces.append(preprocess_face(img))  # Preprocess image before training
-            labels.append(int(student_id))
-        student_ids[int(student_id)] = student_id
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                done.set()
+        cv2.destroyAllWindows()
+    done.set()
+
+    for stage in stages:
+        stage.join()
+
+    if status['camera_error']:
+        notify('Error: Unable to access the camera.', 'error')
+    elif status['saved'] < SAMPLES_PER_STUDENT:
+        notify(f"Only {status['saved']} distinct face images found in {CAPTURE_TIMEOUT:g}s; "
+               "move your head slightly while capturing for better recognition.", 'warning')
+    else:
+        notify(f"{status['saved']} face images captured successfully for user {user_id} "
+               f"({status['duplicates']} near-duplicates skipped)", 'success')
+
+# Next free sample number in faces/<id>, so new samples never overwrite existing ones
+def _next_sample_index(user_dir, user_id):
+    indices = [0]
+    for img_file in os.listdir(user_dir):
+        stem, _ = os.path.splitext(img_file)
+        suffix = stem[len(user_id) + 1:] if stem.startswith(f'{user_id}_') else ''
+        if suffix.isdigit():
+            indices.append(int(suffix))
+    return max(indices) + 1
+
+# Fingerprint of whichever training source is in use: the packed dataset if converted, else faces/
+def _training_fingerprint():
+    if face_dataset.dataset_exists():
+        return face_dataset.dataset_fingerprint()
+    return faces_fingerprint('faces')
+
+# Save new samples for one student and queue them for the live model, so enrolling a student
+# costs time proportional to their own images only
+def enroll_faces(user_id, face_images):
+    if not face_images:
+        return
+
+    with _enroll_lock:
+        _enroll_faces(str(user_id), face_images)
+
+# Body of enroll_faces, run under the enrollment lock so concurrent bursts can't interleave.
+# Only the samples are written here; the model manager folds them into the model in the background
+def _enroll_faces(user_id, face_images):
+    label = label_for(user_id)
+    samples = [preprocess_face(face_img) for face_img in face_images]
 
-    if faces:
-        recognizer.train(faces, np.array(labels))
+    if face_dataset.dataset_exists():
+        # Reading the dataset fingerprint is just its index and one stat
+        fingerprint = face_dataset.dataset_fingerprint()
+        face_dataset.append_samples(user_id, label, samples)
+        enrollment = Enrollment(user_id, label, samples, fingerprint, face_dataset.dataset_fingerprint(), None)
     else:
-        flash('No faces available for training.', 'warning')
+        user_dir = f'faces/{user_id}'
+        if not os.path.exists(user_dir):
+            os.makedirs(user_dir)
+        first_index = _next_sample_index(user_dir, user_id)
+        paths = [f'{user_dir}/{user_id}_{first_index + offset}.jpg' for offset in range(len(face_images))]
+        for path, face_img in zip(paths, face_images):
+            cv2.imwrite(path, face_img)
+        # Only the new files are fingerprinted; the faces/ tree is never walked on this path
+        enrollment = Enrollment(user_id, label, samples, None, None, files_fingerprint(paths))
+
+    model_manager.bump(enrollment)
+
+# Samples written by one enrollment. Dataset appends record the dataset fingerprint before and after
+# the write; faces/ enrollments record the fingerprint of just the files they added, which extends
+# whatever fingerprint the model had since faces_fingerprint() is a XOR over files
+Enrollment = namedtuple('Enrollment', ['user_id', 'label', 'samples', 'fingerprint', 'updated_fingerprint',
+                                       'files_fingerprint'])
+
+# Training data fingerprint once enrollment is added to data with the given fingerprint, or None if
+# the enrollment was made on top of other data (e.g. another process appended to the dataset first)
+def _advance_fingerprint(fingerprint, enrollment):
+    if enrollment.files_fingerprint is None:
+        return enrollment.updated_fingerprint if enrollment.fingerprint == fingerprint else None
+    try:
+        return combine_fingerprints(fingerprint, enrollment.files_fingerprint)
+    except ValueError:  # The model was built from the packed dataset, whose fingerprints don't combine
+        return None
+
+# Add queued enrollments to the live model with extended(), which returns a new recognizer and leaves
+# the snapshot's untouched for recognitions still holding it. Costs time in the new samples only; the
+# model manager saves the result later. Falls back to a full load when the enrollments don't follow
+# on from the snapshot, e.g. another process appended to the dataset in between. Samples another
+# process added to faces/ are not seen here; the model manager's poll notices them
+def apply_enrollments(snapshot, enrollments):
+    if snapshot is None:
+        return load_current_model()
+
+    student_ids = dict(snapshot.student_ids)
+    fingerprint = snapshot.fingerprint
+    faces, labels = [], []
+    for enrollment in enrollments:
+        fingerprint = _advance_fingerprint(fingerprint, enrollment)
+        if fingerprint is None or student_ids.get(enrollment.label, enrollment.user_id) != enrollment.user_id:
+            return load_current_model()
+        faces.extend(enrollment.samples)
+        labels.extend([enrollment.label] * len(enrollment.samples))
+        student_ids[enrollment.label] = enrollment.user_id
+    return snapshot.recognizer.extended(faces, labels), student_ids, fingerprint
+
+# Model store write for the model manager, skipped if that training data is already stored
+def save_snapshot(snapshot):
+    with training_lock():
+        if stored_fingerprint() != snapshot.fingerprint:
+            save_model(snapshot.recognizer, snapshot.student_ids, snapshot.fingerprint)
+
+# (recognizer, student_ids, fingerprint) for the training data as it is now; with stored_only, None
+# instead of training when the model store has nothing for it
+def load_current_model(stored_only=False):
+    fingerprint = _training_fingerprint()
+    model = load_student_faces(fingerprint, stored_only)
+    return model and model + (fingerprint,)
+
+# Load and train LBPH recognizer, reusing the stored model while the training data is unchanged
+def load_student_faces(fingerprint=None, stored_only=False):
+    fingerprint = fingerprint or _training_fingerprint()
+    stored = load_model(fingerprint)
+    if stored is not None or stored_only:
+        return stored
+
+    with training_lock():
+        # Another worker may have trained on the same data while this one waited for the lock
+        stored = load_model(fingerprint)
+        if stored is not None:
+            return stored
+        return _train_student_faces(fingerprint)
+
+# Train from every stored sample and save the result; callers hold the training lock
+def _train_student_faces(fingerprint):
+    recognizer = create_recognizer()
+
+    if face_dataset.dataset_exists():
+        # Packed dataset: hand the zero-copy memmap straight to the recognizer
+        faces, labels, index = face_dataset.open_dataset()
+        student_labels = labels_for(list(index['students']))
+    else:
+        student_dirs = [name for name in os.listdir('faces') if os.path.isdir(f'faces/{name}')]
+        student_labels = labels_for(student_dirs)  # Stable integer labels for string IDs like 'abc123'
+        # Decode and preprocess the stored samples across a process pool
+        faces, labels = load_training_set('faces', student_labels)
+    student_ids = {label: student_id for student_id, label in student_labels.items()}
+
+    if len(faces):
+        recognizer.train(faces, np.asarray(labels))
+        save_model(recognizer, student_ids, fingerprint)
+    else:
+        notify('No faces available for training.', 'warning')
 
     return recognizer, student_ids
 
-# Real-time recognition with enhanced feedback
+# LBPH cannot drop samples, so a classroom subset is trained from just the roster's stored crops
+def _train_lbph_subset(student_ids, labels):
+    recognizer = create_recognizer('lbph')
+    if face_dataset.dataset_exists():
+        dataset_faces, dataset_labels, _ = face_dataset.open_dataset()
+        mask = np.isin(dataset_labels, list(labels))
+        faces, face_labels = dataset_faces[mask], dataset_labels[mask]
+    else:
+        faces, face_labels = load_training_set('faces', {student_ids[label]: label for label in labels})
+
+    if len(faces):
+        recognizer.train(faces, np.asarray(face_labels))
+    return recognizer
+
+# Live model for this process, refreshed in the background after every enrollment
+model_manager = ModelManager(load_current_model, apply_enrollments, save_snapshot, _training_fingerprint)
+
+# Current (recognizer, student_ids); callers keep using what they got even if a newer model is published meanwhile
+def current_model():
+    snapshot = model_manager.current()
+    return snapshot.recognizer, snapshot.student_ids
+
+# Recognizer restricted to one classroom's roster, built lazily and kept in a bounded LRU;
+# returns (recognizer, student_ids, allowed_labels)
+def classroom_recognizer(classroom_id, roster_ids):
+    version, recognizer, student_ids, _ = model_manager.current()
+
+    def build(roster):
+        allowed_labels = {label for label, student_id in student_ids.items() if student_id in roster}
+        if hasattr(recognizer, 'subset'):
+            return recognizer.subset(allowed_labels), allowed_labels
+        return _train_lbph_subset(student_ids, allowed_labels), allowed_labels
+
+    roster = [str(student_id) for student_id in roster_ids]
+    subset, allowed_labels = classroom_models.get(classroom_id, roster, version, build)
+    return subset, student_ids, allowed_labels
+
+# Stored sample count bucketed for timing labels, since predict cost grows with the model
+def model_size_label(recognizer):
+    return size_label(len(recognizer.getLabels()))
+
+# Detect faces only inside region (x, y, w, h), returning boxes in full-frame coordinates
+def detect_in_region(detector, gray, region):
+    x0, y0, w, h = region
+    return [(x + x0, y + y0, bw, bh) for (x, y, bw, bh) in detector.detect(gray[y0:y0 + h, x0:x0 + w])]
+
+# Real-time recognition with enhanced feedback; faces are tracked across frames so each
+# person is only detected every few frames and predicted until their identity is settled
 def recognize_student_with_details(recognizer, student_ids):
-    cap = cv2.VideoCapture(0)
+    camera = shared_camera()
+    sequence = 0
     recognized_id = None
+    tracker = FaceTracker()
+    motion_gate = MotionGate()
+    model_size = model_size_label(recognizer)
 
     while True:
-        ret, frame = cap.read()
-        if not ret:
-            flash('Error: Unable to capture video from camera.', 'error')
+        frame, sequence = camera.read(sequence, CAMERA_TIMEOUT)
+        if frame is None:
+            notify('Error: Unable to capture video from camera.', 'error')
             break
+        frame = frame.copy()  # Ring buffer frames are shared, draw on a private copy
 
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.3, minNeighbors=5)
+        # Detection only runs where something changed; an empty, static scene is barely looked at.
+        # Someone standing still fades into the motion background, so while any face is being
+        # tracked the whole frame is searched until it is identified or its track expires
+        region = motion_gate.changed_region(frame)
+        if region is None and tracker.tracks:
+            region = (0, 0, frame.shape[1], frame.shape[0])
+        idle = region is None
 
-        for (x, y, w, h) in faces:
-            face_img = preprocess_face(gray[y:y + h, x:x + w])
+        if region is not None and tracker.next_frame() and not quality.check_frame(frame):
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            with timed('detect', source='camera') as labels:
+                boxes = detect_in_region(thread_detector(), gray, region)
+                labels['faces'] = count_label(len(boxes))
+            seen = tracker.update(boxes)
 
-            try:
-                label, confidence = recognizer.predict(face_img)
-                if confidence < 50:  # Confidence threshold
-                    recognized_id = student_ids.get(label)
-                    cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-                    cv2.putText(frame, f'ID: {recognized_id}, Conf: {int(confidence)}',
-                                (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-                else:
-                    cv2.putText(frame, 'Unknown', (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-            except cv2.error:
-                cv2.putText(frame, 'Error', (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+            for track in tracker.unresolved(seen):
+                x, y, w, h = track.box
+                face_img = gray[y:y + h, x:x + w]
+                if quality.check_face(face_img):
+                    continue
+                with timed('preprocess'):
+                    face_img = preprocess_face(face_img)
+                try:
+                    with timed('predict', model_size=model_size):
+                        label, confidence = recognizer.predict(face_img)
+                except cv2.error:
+                    continue
+                if confidence < match_threshold(recognizer):
+                    tracker.vote(track, label, confidence)
+                    if track.identity is not None:
+                        recognized_id = student_ids.get(track.identity)
+
+        for track in tracker.tracks:
+            x, y, w, h = track.box
+            if track.identity is not None:
+                cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+                cv2.putText(frame, f'ID: {student_ids.get(track.identity)}, Conf: {int(track.confidence)}',
+                            (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+            else:
+                cv2.putText(frame, 'Unknown', (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
 
         cv2.imshow('Recognition', frame)
 
-        if cv2.waitKey(1) & 0xFF == ord('q') or recognized_id:
+        # Idle frames also wait out MOTION_IDLE_INTERVAL in waitKey, so the loop itself sleeps
+        if cv2.waitKey(int(MOTION_IDLE_INTERVAL * 1000) if idle else 1) & 0xFF == ord('q') or recognized_id:
             break
 
-    cap.release()
     cv2.destroyAllWindows()
     return recognized_id
+
+# Recognize faces in compressed frames uploaded by the browser, entirely in memory (no server camera)
+def recognize_frames(recognizer, student_ids, encoded_frames):
+    results = []
+    model_size = model_size_label(recognizer)
+    for encoded in encoded_frames:
+        with timed('decode'):
+            gray = decode_gray(encoded)
+        if gray is None:
+            results.append({'error': 'Unreadable image', 'faces': []})
+            continue
+        results.append(recognize_frame(recognizer, student_ids, gray, 'upload', model_size))
+    return results
+
+# Detect and identify every face in one decoded frame: {'faces': [...]} or {'rejected': reason};
+# region (x, y, w, h) limits detection to part of the frame, e.g. where a motion gate saw change
+def recognize_frame(recognizer, student_ids, frame, source, model_size=None, region=None):
+    rejected = quality.check_frame(frame)
+    if rejected:
+        return {'rejected': rejected, 'faces': []}
+
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    model_size = model_size or model_size_label(recognizer)
+    frame_faces = []
+    with timed('detect', source=source) as labels:
+        detector = thread_detector()
+        boxes = detect_in_region(detector, gray, region) if region else detector.detect(gray)
+        labels['faces'] = count_label(len(boxes))
+    for (x, y, w, h) in boxes:
+        face_img = gray[y:y + h, x:x + w]
+        if quality.check_face(face_img):
+            continue
+        with timed('preprocess'):
+            face_img = preprocess_face(face_img)
+        try:
+            with timed('predict', model_size=model_size, faces=labels['faces']):
+                label, confidence = recognizer.predict(face_img)
+        except cv2.error:
+            continue
+        matched = confidence < match_threshold(recognizer)
+        frame_faces.append({
+            'student_id': student_ids.get(label) if matched else None,
+            'confidence': round(float(confidence), 2),
+            'box': [int(x), int(y), int(w), int(h)],
+        })
+    return {'faces': frame_faces}
+
+# Best (lowest distance) match per recognized student across a batch of frame results
+def best_matches(frame_results):
+    best = {}
+    for frame in frame_results:
+        for face in frame['faces']:
+            student_id = face['student_id']
+            if student_id is not None and (student_id not in best or face['confidence'] < best[student_id]):
+                best[student_id] = face['confidence']
+    return best
+
+# Closest match among a set of candidate labels (e.g. one classroom's roster)
+def predict_among(recognizer, face_img, allowed_labels):
+    matches = recognizer.predict_topk(face_img, 1, allowed_labels)
+    return matches[0] if matches else (-1, float('inf'))
+
+# Mark everyone visible in one wide frame or a short burst, matching only against allowed_labels
+def recognize_classroom(recognizer, student_ids, encoded_frames, allowed_labels):
+    crops = []
+    for encoded in encoded_frames:
+        with timed('decode'):
+            gray = decode_gray(encoded)
+        if gray is None or quality.check_frame(gray):
+            continue
+        with timed('detect', source='classroom') as labels:
+            boxes = thread_detector(CLASSROOM_DETECTION_WIDTH).detect(gray)
+            labels['faces'] = count_label(len(boxes))
+        for (x, y, w, h) in boxes:
+            face_img = gray[y:y + h, x:x + w]
+            if not quality.check_face(face_img, min_size=CLASSROOM_MIN_FACE_SIZE):
+                crops.append(face_img)
+
+    matches = {}
+    if not crops or not allowed_labels:
+        return matches
+
+    with timed('preprocess'):
+        batch = preprocess_faces(crops)
+    # One observation for the whole batch, labelled with how many crops it held
+    with timed('predict', model_size=model_size_label(recognizer), faces=count_label(len(batch))):
+        if hasattr(recognizer, 'predict_batch'):
+            # One matrix product for every crop in the frame(s)
+            labels, confidences = recognizer.predict_batch(batch, 1, allowed_labels)
+            predictions = list(zip(labels[:, 0], confidences[:, 0]))
+        else:
+            predictions = [predict_among(recognizer, face_img, allowed_labels) for face_img in batch]
+
+    for label, confidence in predictions:
+        if confidence < match_threshold(recognizer):
+            student_id = student_ids[int(label)]
+            matches[student_id] = min(float(confidence), matches.get(student_id, float(confidence)))
+    return matches
@@ -0,0 +1,64 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+from file_lock import file_lock
+from model_store import MODEL_DIR
+
+
+# Persistent mapping of string student IDs (faces/<id>) to the compact integer labels LBPH needs
+REGISTRY_PATH = f'{MODEL_DIR}/labels.json'
+
+_lock = threading.Lock()
+# Labels this process has seen; an assigned label never changes, so hits need no lock or disk read
+_registry = {}
+
+
+def _load():
+    try:
+        with open(REGISTRY_PATH) as f:
+            return {str(k): int(v) for k, v in json.load(f).items()}
+    except (OSError, ValueError):
+        return {}
+
+
+# Held while assigning labels, so web workers and the recognition service can't hand out the same one
+@contextmanager
+def _registry_lock():
+    with _lock, file_lock(f'{REGISTRY_PATH}.lock'):
+        yield
+
+
+def _save(registry):
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    tmp_path = f'{REGISTRY_PATH}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(registry, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, REGISTRY_PATH)
+
+
+# Labels for many students at once, persisting newly assigned ones in a single write. New IDs are
+# assigned from the file as re-read under the lock, never from this process's possibly stale copy
+def labels_for(student_ids):
+    global _registry
+    student_ids = [str(student_id) for student_id in student_ids]
+    registry = _registry
+    if all(student_id in registry for student_id in student_ids):
+        return {student_id: registry[student_id] for student_id in student_ids}
+
+    with _registry_lock():
+        registry = _load()
+        new_ids = [student_id for student_id in dict.fromkeys(student_ids) if student_id not in registry]
+        next_label = max(registry.values(), default=-1) + 1
+        for offset, student_id in enumerate(new_ids):
+            registry[student_id] = next_label + offset
+        if new_ids:
+            _save(registry)
+        _registry = registry
+        return {student_id: registry[student_id] for student_id in student_ids}
+
+
+# Return the label for a student, assigning the next free one on first sight
+def label_for(student_id):
+    return labels_for([student_id])[str(student_id)]
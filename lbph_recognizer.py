@@ -0,0 +1,127 @@
+import copy
+import os
+import shutil
+
+import cv2
+import numpy as np
+
+from face_loader import FACE_SIZE
+
+
+# Samples added after training live in a second, small model retrained from just them; once they
+# outnumber this many (or this fraction of the main model) everything is retrained as one model
+LAYER_FOLD_MIN = 500
+LAYER_FOLD_FRACTION = 0.1
+
+
+class LbphRecognizer:
+    """cv2.face.LBPHFaceRecognizer that keeps the preprocessed crops it was trained on.
+
+    OpenCV's own model file is YAML text holding a 64 KB histogram per sample, which takes longer to
+    write and to read back than training does, and its Python binding offers no other way to hand a
+    model its histograms. The crops are 10 KB each and pack into a plain .npy array, so the stored form
+    of the model is its crops and loading retrains from a memory-mapped copy. That only saves decoding
+    the sample images: loading still costs about as much as training (13.1 s against 15.3 s for 10,000
+    samples), which is why the nn recognizer, whose stored features load without retraining, is the
+    default and this one is only used with SASC_RECOGNIZER=lbph.
+    """
+
+    def __init__(self):
+        self._model = cv2.face.LBPHFaceRecognizer_create()
+        self._faces = np.empty((0,) + FACE_SIZE, dtype=np.uint8)
+        self._labels = np.empty(0, dtype=np.int32)
+        self._added = None
+        self._added_faces = self._faces
+        self._added_labels = self._labels
+
+    def empty(self):
+        return len(self._labels) + len(self._added_labels) == 0
+
+    def getLabels(self):
+        return np.concatenate([self._labels, self._added_labels]).reshape(-1, 1)
+
+    # Faces may be a list of crops or an (n, 100, 100) array; memmapped datasets are kept without a copy
+    def train(self, faces, labels):
+        faces = faces if isinstance(faces, np.ndarray) else np.stack(faces) if len(faces) else self._faces[:0]
+        self._faces = np.asanyarray(faces, dtype=np.uint8).reshape((-1,) + FACE_SIZE)
+        self._labels = np.asarray(labels, dtype=np.int32).ravel()
+        self._model = cv2.face.LBPHFaceRecognizer_create()
+        if len(self._labels):
+            self._model.train(list(self._faces), self._labels)
+        self._added = None
+        self._added_faces, self._added_labels = self._faces[:0], self._labels[:0]
+
+    # New recognizer with the given samples added. This one is left as it is, so recognitions holding
+    # it are unaffected, and the main model is shared rather than copied: the cost is one small
+    # retrain of the added samples, until they grow large enough to fold in with a full retrain
+    def extended(self, faces, labels):
+        faces = np.asarray(faces, dtype=np.uint8).reshape((-1,) + FACE_SIZE)
+        added_faces = np.concatenate([self._added_faces, faces])
+        added_labels = np.concatenate([self._added_labels, np.asarray(labels, dtype=np.int32).ravel()])
+
+        recognizer = copy.copy(self)
+        if len(added_labels) > max(LAYER_FOLD_MIN, LAYER_FOLD_FRACTION * len(self._labels)):
+            recognizer.train(np.concatenate([self._faces, added_faces]), np.concatenate([self._labels, added_labels]))
+        else:
+            recognizer._added = cv2.face.LBPHFaceRecognizer_create()
+            recognizer._added.train(list(added_faces), added_labels)
+            recognizer._added_faces, recognizer._added_labels = added_faces, added_labels
+        return recognizer
+
+    # Trained models to search; an untrained one is kept so predicting with no samples raises cv2.error
+    def _layers(self):
+        layers = [model for model, labels in ((self._model, self._labels), (self._added, self._added_labels))
+                  if len(labels)]
+        return layers or [self._model]
+
+    def predict(self, face):
+        return min((model.predict(face) for model in self._layers()), key=lambda match: match[1])
+
+    # Closest k distinct labels as [(label, distance), ...], optionally only among allowed_labels
+    def predict_topk(self, face, k=5, allowed_labels=None):
+        results = []
+        for model in self._layers():
+            collector = cv2.face.StandardCollector_create()
+            model.predict_collect(face, collector)
+            results.extend(collector.getResults(True))
+
+        matches = []
+        for label, confidence in sorted(results, key=lambda match: match[1]):
+            if (allowed_labels is None or label in allowed_labels) and label not in [seen for seen, _ in matches]:
+                matches.append((int(label), float(confidence)))
+                if len(matches) == k:
+                    break
+        return matches
+
+    # Bytes held by the trained histograms (float32, 2^neighbours bins per grid cell) and the crops in memory
+    def memory_bytes(self):
+        histogram_bytes = 4 * 2 ** self._model.getNeighbors() * self._model.getGridX() * self._model.getGridY()
+        samples = len(self._labels) + len(self._added_labels)
+        crops = self._added_faces.nbytes + (0 if isinstance(self._faces, np.memmap) else self._faces.nbytes)
+        return int(samples * histogram_bytes + crops + 4 * samples)
+
+    # The model is a directory holding faces.npy and labels.npy, written under a temporary name and
+    # renamed into place; afterwards the crops are mapped from the file instead of held in memory
+    def write(self, path):
+        parent, name = os.path.split(path)
+        tmp_path = os.path.join(parent, f'.{name}.{os.getpid()}.tmp')
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        trained = len(self._labels)
+        faces = np.lib.format.open_memmap(os.path.join(tmp_path, 'faces.npy'), mode='w+', dtype=np.uint8,
+                                          shape=(trained + len(self._added_labels),) + FACE_SIZE)
+        faces[:trained] = self._faces
+        faces[trained:] = self._added_faces
+        faces.flush()
+        del faces
+        np.save(os.path.join(tmp_path, 'labels.npy'), np.concatenate([self._labels, self._added_labels]))
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+        self._faces = np.load(os.path.join(path, 'faces.npy'), mmap_mode='r')[:trained]
+
+    def read(self, path):
+        faces = np.load(os.path.join(path, 'faces.npy'), mmap_mode='r')
+        labels = np.load(os.path.join(path, 'labels.npy'))
+        self.train(faces, labels)
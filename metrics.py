@@ -0,0 +1,135 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import quality
+
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 30000, 60000, float('inf'))
+# Log a one-line summary of every stage this often (0 = off); useful in worker processes without /metrics
+METRICS_LOG_INTERVAL = float(os.environ.get('SASC_METRICS_LOG_INTERVAL', 0))
+
+_lock = threading.Lock()
+# (stage, ((label, value), ...)) -> [count, total_ms, per-bucket counts]
+_histograms = {}
+
+
+def _series(stage, labels):
+    return stage, tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def observe(stage, elapsed_ms, **labels):
+    key = _series(stage, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0, 0.0, [0] * len(BUCKETS_MS)]
+        histogram[0] += 1
+        histogram[1] += elapsed_ms
+        for i, bound in enumerate(BUCKETS_MS):
+            if elapsed_ms <= bound:
+                histogram[2][i] += 1
+                break
+
+
+# Time the body of a with-block as one observation of stage; labels can be added inside the block
+# through the yielded dict, e.g. the number of faces only known after detection
+@contextmanager
+def timed(stage, **labels):
+    start = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        observe(stage, (time.perf_counter() - start) * 1000, **labels)
+
+
+# Coarse label values, so series stay few however large the model grows or crowded the frame gets
+def size_label(samples):
+    for bound in (100, 1000, 10000, 100000):
+        if samples < bound:
+            return f'<{bound}'
+    return '100000+'
+
+
+def count_label(count, cap=5):
+    return str(count) if count < cap else f'{cap}+'
+
+
+# Upper bound of the bucket holding the given rank; past the last finite bound that bound is reported,
+# since inf is not valid JSON
+def _percentile(buckets, count, fraction):
+    rank = fraction * count
+    seen = 0
+    for bound, bucket_count in zip(BUCKETS_MS, buckets):
+        seen += bucket_count
+        if seen >= rank:
+            break
+    return min(bound, BUCKETS_MS[-2])
+
+
+# Per-series summary: count, mean and bucket-resolution p50/p95 in milliseconds
+def snapshot():
+    with _lock:
+        items = [(key, (count, total, list(buckets))) for key, (count, total, buckets) in _histograms.items()]
+
+    stages = []
+    for (stage, labels), (count, total, buckets) in sorted(items):
+        stages.append({
+            'stage': stage,
+            'labels': dict(labels),
+            'count': count,
+            'mean_ms': round(total / count, 3),
+            'p50_ms': _percentile(buckets, count, 0.5),
+            'p95_ms': _percentile(buckets, count, 0.95),
+        })
+    return stages
+
+
+# Prometheus text exposition of the stage histograms and the quality gate's rejection counters
+def render_prometheus():
+    with _lock:
+        items = sorted((key, (count, total, list(buckets))) for key, (count, total, buckets) in _histograms.items())
+
+    lines = ['# TYPE sasc_stage_duration_ms histogram']
+    for (stage, labels), (count, total, buckets) in items:
+        label_text = ','.join([f'stage="{stage}"'] + [f'{name}="{value}"' for name, value in labels])
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS_MS, buckets):
+            cumulative += bucket_count
+            le = '+Inf' if bound == float('inf') else bound
+            lines.append(f'sasc_stage_duration_ms_bucket{{{label_text},le="{le}"}} {cumulative}')
+        lines.append(f'sasc_stage_duration_ms_sum{{{label_text}}} {total:.3f}')
+        lines.append(f'sasc_stage_duration_ms_count{{{label_text}}} {count}')
+
+    lines.append('# TYPE sasc_quality_rejections_total counter')
+    for reason, count in sorted(quality.rejection_counts().items()):
+        lines.append(f'sasc_quality_rejections_total{{reason="{reason}"}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def log_summary():
+    parts = []
+    for series in snapshot():
+        labels = ','.join(f'{name}={value}' for name, value in series['labels'].items())
+        parts.append(f"{series['stage']}{'[' + labels + ']' if labels else ''} n={series['count']} "
+                     f"mean={series['mean_ms']}ms p95<={series['p95_ms']}ms")
+    rejections = quality.rejection_counts()
+    if rejections:
+        parts.append('rejected ' + ', '.join(f'{reason}={count}' for reason, count in sorted(rejections.items())))
+    if parts:
+        logger.info('Stage timings: %s', '; '.join(parts))
+
+
+def _log_forever(interval):
+    while True:
+        time.sleep(interval)
+        log_summary()
+
+
+if METRICS_LOG_INTERVAL > 0:
+    threading.Thread(target=_log_forever, args=(METRICS_LOG_INTERVAL,), name='metrics-log', daemon=True).start()
@@ -0,0 +1,26 @@
+-- One attendance row per person, classroom and day.
+-- Removes existing duplicates (keeping the earliest row), then adds the unique keys that
+-- capture_attendance and capture_attendance_batch rely on for INSERT ... ON DUPLICATE KEY UPDATE.
+--
+--   mysql -u root sasc < migrations/001_unique_attendance.sql
+
+UPDATE attendance SET attendance_date = DATE(timestamp) WHERE attendance_date IS NULL;
+
+DELETE newer FROM attendance newer
+JOIN attendance older
+  ON newer.classroom_id = older.classroom_id
+ AND newer.attendance_date = older.attendance_date
+ AND newer.student_id = older.student_id
+ AND newer.id > older.id;
+
+DELETE newer FROM attendance newer
+JOIN attendance older
+  ON newer.classroom_id = older.classroom_id
+ AND newer.attendance_date = older.attendance_date
+ AND newer.teacher_id = older.teacher_id
+ AND newer.id > older.id;
+
+-- NULLs never collide, so student rows (teacher_id NULL) and teacher rows (student_id NULL) each hit one key
+ALTER TABLE attendance
+    ADD UNIQUE KEY uniq_attendance_student (classroom_id, student_id, attendance_date),
+    ADD UNIQUE KEY uniq_attendance_teacher (classroom_id, teacher_id, attendance_date);
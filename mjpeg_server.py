@@ -0,0 +1,84 @@
+"""Local MJPEG test server: streams a video file (or a synthetic moving pattern) over HTTP so
+cameras.py can be exercised against network sources without real IP cameras.
+
+    python mjpeg_server.py --video doorway.mp4 --port 8081
+    python cameras.py http://127.0.0.1:8081/stream.mjpg
+"""
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+
+BOUNDARY = 'sascframe'
+
+
+# Endless JPEG frames from a video file (looped) or a drifting test pattern, paced at fps
+def jpeg_frames(video=None, fps=15, size=(640, 480)):
+    cap = cv2.VideoCapture(video) if video else None
+    pattern = cv2.resize(np.random.default_rng(0).integers(0, 255, (12, 16), dtype=np.uint8), size,
+                         interpolation=cv2.INTER_CUBIC)
+    index = 0
+    while True:
+        if cap is not None:
+            ret, frame = cap.read()
+            if not ret:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                continue
+        else:
+            frame = np.roll(pattern, index * 4, axis=1)
+        index += 1
+        yield cv2.imencode('.jpg', frame)[1].tobytes()
+        time.sleep(1.0 / fps)
+
+
+def make_handler(video, fps):
+    class MjpegHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/stream.mjpg':
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={BOUNDARY}')
+            self.end_headers()
+            try:
+                for jpeg in jpeg_frames(video, fps):
+                    self.wfile.write(f'--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n'
+                                     f'Content-Length: {len(jpeg)}\r\n\r\n'.encode())
+                    self.wfile.write(jpeg + b'\r\n')
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    return MjpegHandler
+
+
+# Start a server in a background thread; returns it so callers (and tests) can shut it down
+def serve_in_background(port=0, video=None, fps=15):
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(video, fps))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', help='video file to stream in a loop (default: synthetic pattern)')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--fps', type=float, default=15)
+    args = parser.parse_args(argv)
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(args.video, args.fps))
+    print(f'Streaming on http://127.0.0.1:{args.port}/stream.mjpg')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+
+logger = logging.getLogger(__name__)
+
+# How often the background thread checks for training data changed by other processes (0 = never)
+MODEL_POLL_INTERVAL = float(os.environ.get('SASC_MODEL_POLL_INTERVAL', 30))
+# Enrollments are patched into the live model straight away but written to the model store only once
+# none has arrived for MODEL_SAVE_DELAY seconds, or MODEL_SAVE_MAX_DELAY after the first unsaved one
+MODEL_SAVE_DELAY = float(os.environ.get('SASC_MODEL_SAVE_DELAY', 10))
+MODEL_SAVE_MAX_DELAY = float(os.environ.get('SASC_MODEL_SAVE_MAX_DELAY', 300))
+
+ModelSnapshot = namedtuple('ModelSnapshot', ['version', 'recognizer', 'student_ids', 'fingerprint'])
+
+
+class ModelManager:
+    """Holds the live recognizer and refreshes it off the request path.
+
+    Every enrollment bumps a monotonically increasing version. A background thread catches up by
+    patching or retraining the model and publishes the result as a new snapshot with a single
+    assignment, so a recognition that already took a snapshot finishes on the version it started with.
+    Patched models are saved on a timer and at exit rather than after every enrollment.
+    """
+
+    def __init__(self, load, apply_enrollments, save, fingerprint, poll_interval=MODEL_POLL_INTERVAL,
+                 save_delay=MODEL_SAVE_DELAY, save_max_delay=MODEL_SAVE_MAX_DELAY):
+        self._load = load                            # (stored_only) -> (recognizer, student_ids, fingerprint) or None
+        self._apply_enrollments = apply_enrollments  # (snapshot, [enrollment, ...]) -> (recognizer, student_ids, fingerprint)
+        self._save = save                            # (snapshot) -> None
+        self._fingerprint = fingerprint              # () -> fingerprint of the training data as it is now
+        self.poll_interval = poll_interval
+        self.save_delay = save_delay
+        self.save_max_delay = save_max_delay
+        self._version = 0
+        self._snapshot = None
+        self._pending = []
+        self._unsaved_since = None  # When the first enrollment not yet in the model store was applied
+        self._changed_at = None     # When the latest one was
+        self._stale_since = None    # When a poll first saw data changed elsewhere with no stored model for it
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._published = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._thread = None
+        atexit.register(self._flush_at_exit)
+
+    def version(self):
+        return self._version
+
+    # Latest published snapshot; the first call in a process loads the model synchronously
+    def current(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = ModelSnapshot(self._version, *self._load(False))
+                snapshot = self._snapshot
+            self._start()
+        return snapshot
+
+    # Record a change to the training data and wake the refresher; returns the new version
+    def bump(self, enrollment=None):
+        with self._lock:
+            self._version += 1
+            if enrollment is not None:
+                self._pending.append(enrollment)
+            version = self._version
+        self._start()
+        self._wake.set()
+        return version
+
+    # Block until a snapshot at least as new as version is published
+    def wait(self, version, timeout=None):
+        with self._published:
+            return self._published.wait_for(
+                lambda: self._snapshot is not None and self._snapshot.version >= version, timeout)
+
+    # Write the live model to the model store if enrollments were patched into it since the last save
+    def flush(self):
+        with self._save_lock:
+            with self._lock:
+                if self._unsaved_since is None:
+                    return
+                self._unsaved_since = None
+                snapshot = self._snapshot
+            try:
+                self._save(snapshot)
+            except Exception:
+                logger.exception('Saving recognition model version %s failed', snapshot.version)
+                return
+            logger.info('Recognition model version %s saved', snapshot.version)
+
+    # Enrollments still being applied are waited for, so they are in the model that gets saved
+    def _flush_at_exit(self):
+        if self._thread is not None:
+            self.wait(self._version, timeout=30)
+        self.flush()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='model-refresh', daemon=True)
+                self._thread.start()
+
+    def _publish(self, model, version=None, unsaved=False):
+        with self._published:
+            if version is None:
+                self._version += 1
+                version = self._version
+            self._snapshot = ModelSnapshot(version, *model)
+            if unsaved:
+                self._changed_at = time.monotonic()
+                self._unsaved_since = self._unsaved_since or self._changed_at
+            self._published.notify_all()
+        logger.info('Recognition model version %s published (%s students)', version, len(model[1]))
+
+    def _save_due(self):
+        with self._lock:
+            if self._unsaved_since is None:
+                return None
+            return min(self._changed_at + self.save_delay, self._unsaved_since + self.save_max_delay)
+
+    def _run(self):
+        next_poll = time.monotonic() + self.poll_interval
+        while True:
+            deadlines = [deadline for deadline in (self.poll_interval and next_poll, self._save_due()) if deadline]
+            self._wake.wait(max(0.0, min(deadlines) - time.monotonic()) if deadlines else None)
+            self._wake.clear()
+            with self._lock:
+                version, pending, self._pending = self._version, self._pending, []
+            snapshot = self._snapshot
+
+            try:
+                if pending:
+                    self._publish(self._apply_enrollments(snapshot, pending), version, unsaved=True)
+                elif snapshot is None or version > snapshot.version:
+                    self._publish(self._load(False), version)
+                elif self.poll_interval and time.monotonic() >= next_poll:
+                    next_poll = time.monotonic() + self.poll_interval
+                    self._poll(snapshot)
+            except Exception:
+                logger.exception('Rebuilding the recognition model failed, keeping version %s',
+                                 snapshot and snapshot.version)
+
+            save_due = self._save_due()
+            if save_due is not None and time.monotonic() >= save_due:
+                self.flush()
+
+    # Periodic check for training data changed by another process. That process saves its patched
+    # model shortly, so this one waits for it to appear in the store and only retrains if it doesn't
+    def _poll(self, snapshot):
+        if self._fingerprint() == snapshot.fingerprint:
+            self._stale_since = None
+            return
+        now = time.monotonic()
+        self._stale_since = self._stale_since or now
+        model = self._load(now - self._stale_since < self.save_max_delay + self.save_delay)
+        if model is not None:
+            self._stale_since = None
+            self._publish(model)
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import shutil
+
+import cv2
+
+from file_lock import file_lock
+from lbph_recognizer import LbphRecognizer
+from nn_recognizer import NearestNeighbourRecognizer
+
+
+# Where the trained recognizer and its label map are kept between runs
+MODEL_DIR = os.environ.get('SASC_MODEL_DIR', 'models')
+META_PATH = f'{MODEL_DIR}/model_meta.json'
+
+# Recognizer implementation: 'nn' (vectorized nearest neighbour, see nn_recognizer.py) or 'lbph' (OpenCV).
+# nn is the default because its stored model loads as is; a stored LBPH model still has to be retrained
+# on load (see LbphRecognizer), which costs nearly as much as training it from the sample images
+RECOGNIZER_KIND = os.environ.get('SASC_RECOGNIZER', 'nn')
+# Both are directories of .npy arrays: the preprocessed crops LBPH retrains from, or the nn feature matrix
+MODEL_EXTENSIONS = {'lbph': 'crops', 'nn': 'arrays'}
+
+
+def create_recognizer(kind=None):
+    kind = kind or RECOGNIZER_KIND
+    if kind == 'nn':
+        return NearestNeighbourRecognizer()
+    if kind == 'lbph':
+        return LbphRecognizer()
+    raise ValueError(f"Unknown recognizer '{kind}', expected one of: {', '.join(MODEL_EXTENSIONS)}")
+
+
+def recognizer_kind(recognizer):
+    return 'nn' if isinstance(recognizer, NearestNeighbourRecognizer) else 'lbph'
+
+# Last model saved or loaded by this process, so repeat calls skip reading the model file
+_cached = None
+
+
+# Cheap fingerprint of the training data: file list, sizes and mtimes only, no image decoding
+def faces_fingerprint(faces_dir='faces'):
+    paths = []
+    if os.path.isdir(faces_dir):
+        for root, dirs, files in os.walk(faces_dir):
+            paths.extend(os.path.join(root, name) for name in files)
+    return files_fingerprint(paths, faces_dir)
+
+
+# XOR of one digest per file, so a tree's fingerprint is combine_fingerprints() of its parts' and
+# enrollment can extend a known fingerprint by just the files it wrote, without walking the tree
+def files_fingerprint(paths, faces_dir='faces'):
+    fingerprint = 0
+    for path in paths:
+        stat = os.stat(path)
+        rel_path = os.path.relpath(path, faces_dir).replace(os.sep, '/')
+        fingerprint ^= int(hashlib.sha1(f'{rel_path}|{stat.st_size}|{stat.st_mtime_ns}'.encode()).hexdigest(), 16)
+    return f'{fingerprint:040x}'
+
+
+def combine_fingerprints(*fingerprints):
+    combined = 0
+    for fingerprint in fingerprints:
+        combined ^= int(fingerprint, 16)
+    return f'{combined:040x}'
+
+
+# Held while training, so when several WSGI workers start on new data only one of them trains
+# and the rest load the model it saves
+def training_lock():
+    return file_lock(f'{MODEL_DIR}/train.lock')
+
+
+# Persist the recognizer and label map; the metadata file is swapped in last so readers never see a half-written model
+def save_model(recognizer, student_ids, fingerprint):
+    global _cached
+    os.makedirs(MODEL_DIR, exist_ok=True)
+
+    kind = recognizer_kind(recognizer)
+    model_file = f'{kind}-{hashlib.sha1(fingerprint.encode()).hexdigest()[:16]}.{MODEL_EXTENSIONS[kind]}'
+    recognizer.write(f'{MODEL_DIR}/{model_file}')
+
+    meta = {
+        'kind': kind,
+        'fingerprint': fingerprint,
+        'model_file': model_file,
+        'student_ids': {str(label): student_id for label, student_id in student_ids.items()},
+    }
+    tmp_path = f'{META_PATH}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, META_PATH)
+    _cached = (fingerprint, recognizer, dict(student_ids))
+
+    # Drop models trained from older snapshots of the training data
+    for name in os.listdir(MODEL_DIR):
+        if name.startswith(tuple(f'{kind}-' for kind in MODEL_EXTENSIONS)) and name != model_file:
+            # Processes still mapping an older nn model keep their mapping until they reload
+            path = f'{MODEL_DIR}/{name}'
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def _read_meta():
+    try:
+        with open(META_PATH) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get('kind', 'lbph') == RECOGNIZER_KIND else None
+
+
+# Fingerprint of the training data behind the stored model, or None if nothing usable is stored
+def stored_fingerprint():
+    meta = _read_meta()
+    return meta and meta.get('fingerprint')
+
+
+# Load the stored recognizer if it was trained from data matching the fingerprint, otherwise None
+def load_model(fingerprint):
+    global _cached
+    if _cached is not None and _cached[0] == fingerprint and recognizer_kind(_cached[1]) == RECOGNIZER_KIND:
+        return _cached[1], dict(_cached[2])
+
+    meta = _read_meta()
+    if meta is None or meta.get('fingerprint') != fingerprint:
+        return None
+
+    model_path = f"{MODEL_DIR}/{meta['model_file']}"
+    if not os.path.exists(model_path):
+        return None
+
+    recognizer = create_recognizer()
+    try:
+        recognizer.read(model_path)
+    except (cv2.error, OSError, ValueError, KeyError):
+        return None
+
+    student_ids = {int(label): student_id for label, student_id in meta['student_ids'].items()}
+    _cached = (fingerprint, recognizer, student_ids)
+    return recognizer, dict(student_ids)
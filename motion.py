@@ -0,0 +1,56 @@
+import os
+
+import cv2
+import numpy as np
+
+
+# Motion is measured on a copy this wide; a 64 px frame is enough to see someone walk up
+MOTION_WIDTH = int(os.environ.get('SASC_MOTION_WIDTH', 64))
+# Per-pixel difference from the background (0-255) that counts as change
+MOTION_THRESHOLD = float(os.environ.get('SASC_MOTION_THRESHOLD', 25))
+# Fraction of the small frame that has to change before detection runs
+MOTION_MIN_AREA = float(os.environ.get('SASC_MOTION_MIN_AREA', 0.002))
+# How fast the background absorbs changes; a person standing still fades into it after roughly 1/rate frames
+BACKGROUND_RATE = 0.05
+# The changed region is grown by this fraction of its size, since only part of a face moves
+REGION_MARGIN = 0.5
+
+
+class MotionGate:
+    """Frame differencing against a running-average background on a tiny copy of each frame.
+
+    changed_region() returns the box (in full-frame coordinates) around whatever changed, or None
+    when the scene is static, so detection can be skipped or confined to where something moved.
+    """
+
+    def __init__(self, width=MOTION_WIDTH, threshold=MOTION_THRESHOLD, min_area=MOTION_MIN_AREA,
+                 rate=BACKGROUND_RATE):
+        self.width = width
+        self.threshold = threshold
+        self.min_area = min_area
+        self.rate = rate
+        self._background = None
+
+    def changed_region(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        height, width = gray.shape
+        scale = width / self.width
+        small = cv2.resize(gray, (self.width, max(1, round(height / scale))), interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(small, (3, 3), 0).astype(np.float32)
+
+        if self._background is None or self._background.shape != small.shape:
+            # Nothing to compare against yet: everything is new
+            self._background = small
+            return 0, 0, width, height
+
+        changed = cv2.absdiff(small, self._background) > self.threshold
+        cv2.accumulateWeighted(small, self._background, self.rate)
+        if changed.mean() < self.min_area:
+            return None
+
+        ys, xs = np.nonzero(changed)
+        x0, x1, y0, y1 = xs.min(), xs.max() + 1, ys.min(), ys.max() + 1
+        pad_x, pad_y = (x1 - x0) * REGION_MARGIN, (y1 - y0) * REGION_MARGIN
+        x0, y0 = max(0, int((x0 - pad_x) * scale)), max(0, int((y0 - pad_y) * scale))
+        x1, y1 = min(width, int((x1 + pad_x) * scale)), min(height, int((y1 + pad_y) * scale))
+        return x0, y0, x1 - x0, y1 - y0
@@ -0,0 +1,379 @@
+import copy
+import os
+import shutil
+
+import cv2
+import numpy as np
+
+from face_loader import FACE_SIZE
+
+
+GRID = (8, 8)
+
+# Distance below which a prediction counts as a match (0 = identical, 100 = nothing in common).
+# Shifted, rotated and relit copies of a stored photo score 28-40 and other people 55 and up; on the
+# benchmark's synthetic faces the split is 32 and below against 43 and up
+NN_CONFIDENCE_THRESHOLD = float(os.environ.get('SASC_NN_THRESHOLD', 42))
+# Features are projected onto this many principal components at train time (0 keeps the raw histograms);
+# matching cost is bound by the size of the feature matrix, so this is what keeps 50k+ samples fast
+NN_COMPONENTS = int(os.environ.get('SASC_NN_COMPONENTS', 256))
+PCA_SAMPLE_SIZE = 5000
+# Crops are turned into histograms this many at a time, bounding lbp_features' per-pixel scratch arrays
+FEATURE_CHUNK = 512
+# Stored feature precision: 'float32', 'float16' or 'uint8' (per-dimension affine quantization), and
+# how many k-means prototypes to keep per student (0 keeps every sample)
+NN_STORAGE = os.environ.get('SASC_NN_STORAGE', 'float32')
+NN_PROTOTYPES = int(os.environ.get('SASC_NN_PROTOTYPES', 0))
+STORAGE_DTYPES = {'float32': np.float32, 'float16': np.float16, 'uint8': np.uint8}
+# Compact rows are widened to float32 this many at a time while matching, bounding the scratch memory
+MATCH_BLOCK_ROWS = 16384
+
+# Neighbour offsets for radius-1, 8-point LBP, clockwise from the top-left
+_NEIGHBOURS = [(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)]
+
+
+def _uniform_lut():
+    # Uniform patterns (at most two 0/1 transitions) get their own bin, everything else shares the last one
+    lut = np.full(256, 58, dtype=np.uint8)
+    next_bin = 0
+    for code in range(256):
+        bits = [(code >> i) & 1 for i in range(8)]
+        if sum(bits[i] != bits[(i + 1) % 8] for i in range(8)) <= 2:
+            lut[code] = next_bin
+            next_bin += 1
+    return lut
+
+
+_UNIFORM_LUT = _uniform_lut()
+_BINS = 59
+
+
+def _cell_layout():
+    height, width = FACE_SIZE[0] - 2, FACE_SIZE[1] - 2
+    row_cell = np.minimum(np.arange(height) * GRID[0] // height, GRID[0] - 1)
+    col_cell = np.minimum(np.arange(width) * GRID[1] // width, GRID[1] - 1)
+    cell_ids = (row_cell[:, None] * GRID[1] + col_cell[None, :]).astype(np.int64)
+    cell_sizes = np.bincount(cell_ids.ravel(), minlength=GRID[0] * GRID[1]).astype(np.float32)
+    return cell_ids, cell_sizes
+
+
+_CELL_IDS, _CELL_SIZES = _cell_layout()
+FEATURE_DIM = GRID[0] * GRID[1] * _BINS
+
+
+# Uniform LBP histograms on an 8x8 grid for a batch of 100x100 crops, as square-rooted
+# per-cell distributions so Hellinger distance reduces to a dot product
+def lbp_features(faces):
+    faces = np.asarray(faces, dtype=np.uint8).reshape((-1,) + FACE_SIZE)
+    count = len(faces)
+    pixels = faces.astype(np.int16)
+    center = pixels[:, 1:-1, 1:-1]
+
+    codes = np.zeros(center.shape, dtype=np.uint8)
+    for bit, (dy, dx) in enumerate(_NEIGHBOURS):
+        neighbour = pixels[:, 1 + dy:FACE_SIZE[0] - 1 + dy, 1 + dx:FACE_SIZE[1] - 1 + dx]
+        codes |= (neighbour >= center).astype(np.uint8) << bit
+
+    # One bincount over (image, cell, bin) builds every histogram in the batch at once
+    bins = _CELL_IDS * _BINS + _UNIFORM_LUT[codes]
+    bins += (np.arange(count, dtype=np.int64) * FEATURE_DIM)[:, None, None]
+    hist = np.bincount(bins.ravel(), minlength=count * FEATURE_DIM).astype(np.float32)
+    hist = hist.reshape(count, GRID[0] * GRID[1], _BINS) / _CELL_SIZES[None, :, None]
+    return np.sqrt(hist).reshape(count, FEATURE_DIM)
+
+
+# The given rows of faces (a list of crops or an array) as one batch
+def _take(faces, rows):
+    if isinstance(faces, np.ndarray):
+        return faces[rows]
+    return [faces[row] for row in rows]
+
+
+# Cluster one student's samples into at most count prototypes (k-means centres)
+def reduce_to_prototypes(features, count, seed=0):
+    if count <= 0 or len(features) <= count:
+        return features
+    cv2.setRNGSeed(seed)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1e-4)
+    _, _, centres = cv2.kmeans(np.ascontiguousarray(features, dtype=np.float32), count, None, criteria, 1,
+                               cv2.KMEANS_PP_CENTERS)
+    return centres
+
+
+# Randomized PCA basis (mean, components) for the rows of features
+def fit_projection(features, components, seed=0):
+    rng = np.random.default_rng(seed)
+    if len(features) > PCA_SAMPLE_SIZE:
+        features = features[rng.choice(len(features), PCA_SAMPLE_SIZE, replace=False)]
+    mean = features.mean(axis=0)
+    centered = features - mean
+
+    # Range finder with two power iterations, then an exact SVD of the small projected matrix
+    sketch = centered @ rng.standard_normal((FEATURE_DIM, components + 10)).astype(np.float32)
+    for _ in range(2):
+        sketch, _ = np.linalg.qr(sketch)
+        sketch = centered @ (centered.T @ sketch)
+    basis, _ = np.linalg.qr(sketch)
+    _, _, vt = np.linalg.svd(basis.T @ centered, full_matrices=False)
+    return mean.astype(np.float32), np.ascontiguousarray(vt[:components].T, dtype=np.float32)
+
+
+class NearestNeighbourRecognizer:
+    """Drop-in alternative to cv2.face.LBPHFaceRecognizer with all training features in one matrix.
+
+    Queries are answered with a single matrix product against every stored sample, so batches of
+    crops and top-k lookups cost one BLAS call instead of a linear scan per crop. Features can be
+    stored as float16 or uint8 and reduced to a few prototypes per student to shrink the model;
+    matching then runs on the compact rows directly.
+    """
+
+    threshold = NN_CONFIDENCE_THRESHOLD
+
+    def __init__(self, components=NN_COMPONENTS, storage=NN_STORAGE, prototypes=NN_PROTOTYPES):
+        if storage not in STORAGE_DTYPES:
+            raise ValueError(f"Unknown storage '{storage}', expected one of: {', '.join(STORAGE_DTYPES)}")
+        self.components = components
+        self.storage = storage
+        self.prototypes = prototypes
+        self._reset()
+
+    def _reset(self):
+        self._mean = None
+        self._basis = None
+        # uint8 storage: feature = code * scale + offset, per dimension
+        self._scale = None
+        self._offset = None
+        self._features = np.empty((0, 0), dtype=STORAGE_DTYPES[self.storage])
+        self._norms = np.empty(0, dtype=np.float32)
+        self._labels = np.empty(0, dtype=np.int32)
+        self._size = 0
+
+    @property
+    def features(self):
+        return self._features[:self._size]
+
+    @property
+    def labels(self):
+        return self._labels[:self._size]
+
+    def empty(self):
+        return self._size == 0
+
+    def getLabels(self):
+        return self.labels.reshape(-1, 1)
+
+    # Raw histogram features projected into the matching space, plus the squared norm each one loses
+    # to the projection (zero without one)
+    def _project(self, features):
+        residuals = np.zeros(len(features), dtype=np.float32)
+        if self._basis is not None:
+            centered = features - self._mean
+            features = centered @ self._basis
+            residuals = np.einsum('ij,ij->i', centered, centered) - np.einsum('ij,ij->i', features, features)
+        return np.ascontiguousarray(features, dtype=np.float32), np.maximum(residuals, 0.0)
+
+    # _project(lbp_features(faces)), FEATURE_CHUNK crops at a time so only projected rows accumulate
+    def _embed(self, faces, rows=None):
+        rows = np.arange(len(faces)) if rows is None else rows
+        dims = FEATURE_DIM if self._basis is None else self._basis.shape[1]
+        features = np.empty((len(rows), dims), dtype=np.float32)
+        residuals = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), FEATURE_CHUNK):
+            chunk = rows[start:start + FEATURE_CHUNK]
+            features[start:start + len(chunk)], residuals[start:start + len(chunk)] = \
+                self._project(lbp_features(_take(faces, chunk)))
+        return features, residuals
+
+    # Bytes held by the model's arrays (features, norms, labels and projection)
+    def memory_bytes(self):
+        arrays = [self.features, self._norms[:self._size], self.labels, self._mean, self._basis, self._scale, self._offset]
+        return int(sum(array.nbytes for array in arrays if array is not None))
+
+    # Each crop's histogram is computed once: the PCA sample's are kept to fit the projection and then
+    # projected themselves, every other crop is embedded chunk by chunk
+    def train(self, faces, labels, seed=0):
+        self._reset()
+        if self.components and len(faces) > self.components:
+            sample = np.sort(np.random.default_rng(seed).permutation(len(faces))[:PCA_SAMPLE_SIZE])
+            sample_features = np.concatenate([lbp_features(_take(faces, sample[start:start + FEATURE_CHUNK]))
+                                              for start in range(0, len(sample), FEATURE_CHUNK)])
+            self._mean, self._basis = fit_projection(sample_features, self.components, seed)
+            features = np.empty((len(faces), self._basis.shape[1]), dtype=np.float32)
+            features[sample] = self._project(sample_features)[0]
+            del sample_features
+            rest = np.setdiff1d(np.arange(len(faces)), sample)
+            features[rest] = self._embed(faces, rest)[0]
+        else:
+            features, _ = self._embed(faces)
+        self._append(*self._reduce(features, labels))
+
+    # Append samples, growing the backing arrays geometrically so repeated enrollment stays cheap
+    def update(self, faces, labels):
+        features, _ = self._embed(faces)
+        self._append(*self._reduce(features, labels))
+
+    # New recognizer with the given samples added, sharing this one's arrays: new rows go into spare
+    # capacity past this recognizer's size, which it never reads, so it stays valid for recognitions
+    # holding it. Only the newest recognizer in a chain may be extended (the model manager's thread does)
+    def extended(self, faces, labels):
+        recognizer = copy.copy(self)
+        recognizer.update(faces, labels)
+        return recognizer
+
+    # Replace each student's samples by their k-means prototypes when prototypes are enabled
+    def _reduce(self, features, labels):
+        labels = np.asarray(labels, dtype=np.int32).ravel()
+        if not self.prototypes:
+            return features, labels
+        reduced_features, reduced_labels = [], []
+        for label in np.unique(labels):
+            centres = reduce_to_prototypes(features[labels == label], self.prototypes)
+            reduced_features.append(centres)
+            reduced_labels.append(np.full(len(centres), label, dtype=np.int32))
+        return np.concatenate(reduced_features), np.concatenate(reduced_labels)
+
+    # float32 features to the stored representation and back; uint8 ranges are fixed by the first
+    # batch stored (the training set), later values outside them are clipped
+    def _encode(self, features):
+        if self.storage == 'uint8' and self._scale is None:
+            low, high = features.min(axis=0), features.max(axis=0)
+            self._offset = low.astype(np.float32)
+            self._scale = np.maximum((high - low) / 255.0, 1e-6).astype(np.float32)
+        if self.storage == 'uint8':
+            return np.clip(np.rint((features - self._offset) / self._scale), 0, 255).astype(np.uint8)
+        return features.astype(STORAGE_DTYPES[self.storage])
+
+    def _decode(self, stored):
+        if self.storage == 'uint8':
+            return stored.astype(np.float32) * self._scale + self._offset
+        return stored.astype(np.float32)
+
+    def _append(self, features, labels):
+        stored = self._encode(features)
+        # Norms of what is actually stored, so distances stay consistent with the quantized rows
+        decoded = self._decode(stored)
+        needed = self._size + len(features)
+        if needed > len(self._features):
+            capacity = max(needed, 2 * len(self._features), 64)
+            grown_features = np.empty((capacity, features.shape[1]), dtype=STORAGE_DTYPES[self.storage])
+            grown_norms = np.empty(capacity, dtype=np.float32)
+            grown_labels = np.empty(capacity, dtype=np.int32)
+            if self._size:
+                grown_features[:self._size] = self.features
+                grown_norms[:self._size] = self._norms[:self._size]
+                grown_labels[:self._size] = self.labels
+            self._features, self._norms, self._labels = grown_features, grown_norms, grown_labels
+        self._features[self._size:needed] = stored
+        self._norms[self._size:needed] = np.einsum('ij,ij->i', decoded, decoded)
+        self._labels[self._size:needed] = labels
+        self._size = needed
+
+    # New recognizer holding only the samples of the given labels, sharing this one's projection
+    def subset(self, labels):
+        mask = np.isin(self.labels, np.fromiter(labels, dtype=np.int32))
+        recognizer = NearestNeighbourRecognizer(self.components, self.storage, self.prototypes)
+        recognizer._mean, recognizer._basis = self._mean, self._basis
+        recognizer._scale, recognizer._offset = self._scale, self._offset
+        recognizer._features = np.ascontiguousarray(self.features[mask])
+        recognizer._norms = self._norms[:self._size][mask]
+        recognizer._labels = self.labels[mask]
+        recognizer._size = int(mask.sum())
+        return recognizer
+
+    # queries @ stored features.T, widening compact rows block by block instead of all at once
+    def _dot_stored(self, queries):
+        if self.storage == 'float32':
+            return queries @ self.features.T
+        if self.storage == 'uint8':
+            # (code * scale + offset) . q  ==  code . (q * scale) + offset . q
+            scaled, shift = queries * self._scale, (queries @ self._offset)[:, None]
+        else:
+            scaled, shift = queries, 0.0
+        products = np.empty((len(queries), self._size), dtype=np.float32)
+        for start in range(0, self._size, MATCH_BLOCK_ROWS):
+            block = self._features[start:min(start + MATCH_BLOCK_ROWS, self._size)].astype(np.float32)
+            products[:, start:start + len(block)] = scaled @ block.T + shift
+        return products
+
+    # Top-k distinct labels for each crop in a batch; returns (labels, confidences), both (n, k),
+    # padded with -1 / inf when fewer than k identities are available
+    def predict_batch(self, faces, k=1, allowed_labels=None):
+        queries, residuals = self._embed(faces)
+        result_labels = np.full((len(queries), k), -1, dtype=np.int32)
+        result_confidences = np.full((len(queries), k), np.inf, dtype=np.float32)
+        if self._size == 0:
+            return result_labels, result_confidences
+
+        # Squared distances, up to the per-query constant |q|^2 which doesn't change the ranking
+        distances = self._norms[:self._size] - 2.0 * self._dot_stored(queries)
+        if allowed_labels is not None:
+            mask = np.isin(self.labels, np.fromiter(allowed_labels, dtype=np.int32))
+            distances[:, ~mask] = np.inf
+        # Energy outside the projection is added back so unknown faces don't look deceptively close
+        query_norms = np.einsum('ij,ij->i', queries, queries) + residuals
+
+        # Several samples per student, so look at a few more than k samples to find k distinct labels
+        candidates = min(self._size, k * 8)
+        top = np.argpartition(distances, candidates - 1, axis=1)[:, :candidates]
+        for row in range(len(queries)):
+            order = top[row][np.argsort(distances[row, top[row]])]
+            if len(set(self.labels[order])) < k and candidates < self._size:
+                order = np.argsort(distances[row])
+            seen = 0
+            for sample in order:
+                if seen == k or not np.isfinite(distances[row, sample]):
+                    break
+                label = self.labels[sample]
+                if label in result_labels[row, :seen]:
+                    continue
+                result_labels[row, seen] = label
+                result_confidences[row, seen] = self._confidence(distances[row, sample] + query_norms[row])
+                seen += 1
+        return result_labels, result_confidences
+
+    def predict_topk(self, face, k=5, allowed_labels=None):
+        labels, confidences = self.predict_batch([face], k, allowed_labels)
+        return [(int(label), float(confidence)) for label, confidence in zip(labels[0], confidences[0]) if label != -1]
+
+    def predict(self, face):
+        labels, confidences = self.predict_batch([face])
+        return int(labels[0, 0]), float(confidences[0, 0])
+
+    # Hellinger distance rescaled to 0..100; every cell is a unit vector, so the largest squared distance is 2 * cells
+    @staticmethod
+    def _confidence(squared_distance):
+        return 100.0 * float(np.sqrt(max(0.0, squared_distance) / (2.0 * GRID[0] * GRID[1])))
+
+    # The model is a directory of plain .npy arrays, written under a temporary name and renamed into
+    # place, so a given path is immutable once it exists and is safe to map from other processes
+    def write(self, path):
+        parent, name = os.path.split(path)
+        tmp_path = os.path.join(parent, f'.{name}.{os.getpid()}.tmp')
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        arrays = {'features': self.features, 'norms': self._norms[:self._size], 'labels': self.labels}
+        if self._basis is not None:
+            arrays.update(mean=self._mean, basis=self._basis)
+        if self._scale is not None:
+            arrays.update(scale=self._scale, offset=self._offset)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f'{name}.npy'), np.ascontiguousarray(array))
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+
+    # Arrays are memory-mapped read-only: every worker process shares the same page-cache copy of the
+    # matrix instead of holding its own, and update() copies into private memory only when it grows
+    def read(self, path):
+        self._reset()
+        arrays = {name[:-4]: np.load(os.path.join(path, name), mmap_mode='r')
+                  for name in os.listdir(path) if name.endswith('.npy')}
+        if 'basis' in arrays:
+            self._mean, self._basis = arrays['mean'], arrays['basis']
+        if 'scale' in arrays:
+            self._scale, self._offset = arrays['scale'], arrays['offset']
+        self._features, self._norms, self._labels = arrays['features'], arrays['norms'], arrays['labels']
+        # The stored precision travels with the model, whatever this process was configured with
+        self.storage = next(name for name, dtype in STORAGE_DTYPES.items() if self._features.dtype == dtype)
+        self._size = len(self._labels)
@@ -0,0 +1,72 @@
+import os
+import threading
+from collections import Counter
+
+import cv2
+
+
+# Thresholds for rejecting frames and face crops before the expensive detection/prediction calls
+MIN_SHARPNESS = float(os.environ.get('SASC_MIN_SHARPNESS', 40))      # Variance of the Laplacian
+MIN_BRIGHTNESS = float(os.environ.get('SASC_MIN_BRIGHTNESS', 40))    # Mean intensity, 0-255
+MAX_BRIGHTNESS = float(os.environ.get('SASC_MAX_BRIGHTNESS', 220))
+MIN_FACE_SIZE = int(os.environ.get('SASC_MIN_FACE_SIZE', 60))        # Pixels, shorter side of the box
+
+# Frames are measured on a small copy; blur and exposure survive downscaling well enough
+_MEASURE_WIDTH = 160
+
+_lock = threading.Lock()
+_rejections = Counter()
+
+
+def _reject(reason):
+    with _lock:
+        _rejections[reason] += 1
+    return reason
+
+
+# How many frames/crops each rule has rejected so far, e.g. {'frame:dark': 3, 'face:small': 12}
+def rejection_counts():
+    with _lock:
+        return dict(_rejections)
+
+
+def _to_gray(image):
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+
+def sharpness(gray):
+    return cv2.Laplacian(gray, cv2.CV_64F).var()
+
+
+def _exposure_problem(gray):
+    brightness = gray.mean()
+    if brightness < MIN_BRIGHTNESS:
+        return 'dark'
+    if brightness > MAX_BRIGHTNESS:
+        return 'bright'
+    return None
+
+
+# Reason the whole frame is unusable ('frame:dark', 'frame:bright', 'frame:blurry') or None
+def check_frame(frame):
+    gray = _to_gray(frame)
+    if gray.shape[1] > _MEASURE_WIDTH:
+        height = max(1, gray.shape[0] * _MEASURE_WIDTH // gray.shape[1])
+        gray = cv2.resize(gray, (_MEASURE_WIDTH, height), interpolation=cv2.INTER_AREA)
+
+    problem = _exposure_problem(gray)
+    if problem is None and sharpness(gray) < MIN_SHARPNESS:
+        problem = 'blurry'
+    return _reject(f'frame:{problem}') if problem else None
+
+
+# Reason a detected face crop is unusable ('face:small', 'face:dark', 'face:bright', 'face:blurry') or None
+def check_face(face_img, min_size=MIN_FACE_SIZE):
+    if min(face_img.shape[:2]) < min_size:
+        return _reject('face:small')
+
+    gray = _to_gray(face_img)
+    problem = _exposure_problem(gray)
+    if problem is None and sharpness(gray) < MIN_SHARPNESS:
+        problem = 'blurry'
+    return _reject(f'face:{problem}') if problem else None
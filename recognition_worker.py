@@ -0,0 +1,181 @@
+import itertools
+import logging
+import os
+import secrets
+import tempfile
+import threading
+import time
+from multiprocessing import Pool
+from multiprocessing.connection import Client, Listener
+
+
+logger = logging.getLogger(__name__)
+
+# Unix socket path, or host:port where AF_UNIX is unavailable
+WORKER_ADDRESS = os.environ.get('SASC_WORKER_ADDRESS',
+                                '/tmp/sasc-recognition.sock' if hasattr(os, 'fork') else '127.0.0.1:6001')
+# Shared secret for the socket. Without SASC_WORKER_AUTHKEY a random key is generated on first use into
+# a file only this user can read, which the service and the web tier share when run as the same user
+WORKER_KEY_FILE = os.environ.get('SASC_WORKER_KEY_FILE', os.path.expanduser('~/.sasc/worker.key'))
+WORKER_PROCESSES = int(os.environ.get('SASC_WORKER_PROCESSES', os.cpu_count() or 1))
+# Finished results nobody collected are dropped after this many seconds
+RESULT_TTL = 300
+
+
+def _address(address=WORKER_ADDRESS):
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def worker_authkey(key_file=WORKER_KEY_FILE):
+    key = os.environ.get('SASC_WORKER_AUTHKEY')
+    if key:
+        return key.encode()
+
+    if not os.path.exists(key_file):
+        key_dir = os.path.dirname(key_file) or '.'
+        os.makedirs(key_dir, mode=0o700, exist_ok=True)
+        # Written in full under a temporary name and linked into place, so a concurrent reader never
+        # sees a partial key and two processes starting together agree on one
+        fd, tmp_path = tempfile.mkstemp(dir=key_dir)  # Created 0600
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+        try:
+            os.link(tmp_path, key_file)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+
+    stat = os.stat(key_file)
+    if os.name == 'posix' and (stat.st_uid != os.getuid() or stat.st_mode & 0o077):
+        raise PermissionError(f'{key_file} must belong to this user and not be readable by others')
+    with open(key_file) as f:
+        return f.read().strip().encode()
+
+
+# Pool initializer: load the model and detector once per worker process and keep them warm
+def _warm_up():
+    import function
+    function.current_model()
+
+
+# Runs inside a pool worker; the model comes from the worker's own model manager, which picks up
+# enrollments made by the web tier on its next poll
+def run_recognition(kind, frames, classroom_id=None, roster=None):
+    import function
+
+    if classroom_id is not None and roster is not None:
+        recognizer, student_ids, allowed_labels = function.classroom_recognizer(classroom_id, roster)
+    else:
+        recognizer, student_ids = function.current_model()
+        allowed_labels = set(student_ids)
+
+    if kind == 'classroom':
+        return function.recognize_classroom(recognizer, student_ids, frames, allowed_labels)
+    if kind == 'frames':
+        return function.recognize_frames(recognizer, student_ids, frames)
+    raise ValueError(f"Unknown recognition job '{kind}'")
+
+
+class RecognitionService:
+    """Owns a pool of warm recognition processes and serves jobs to the web tier over a local socket."""
+
+    def __init__(self, address=WORKER_ADDRESS, processes=WORKER_PROCESSES):
+        self.address = _address(address)
+        self.pool = Pool(processes=processes, initializer=_warm_up)
+        self.jobs = {}
+        self.job_ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def submit(self, kind, frames, classroom_id=None, roster=None):
+        with self.lock:
+            job_id = next(self.job_ids)
+            self.jobs[job_id] = (time.monotonic(), self.pool.apply_async(
+                run_recognition, (kind, frames, classroom_id, roster)))
+        return job_id
+
+    def result(self, job_id, timeout=0):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return {'status': 'unknown'}
+
+        async_result = job[1]
+        async_result.wait(timeout)
+        if not async_result.ready():
+            return {'status': 'pending'}
+
+        with self.lock:
+            self.jobs.pop(job_id, None)
+        try:
+            return {'status': 'done', 'result': async_result.get()}
+        except Exception as e:
+            return {'status': 'error', 'error': str(e)}
+
+    def _expire(self):
+        cutoff = time.monotonic() - RESULT_TTL
+        with self.lock:
+            for job_id in [job_id for job_id, (submitted, _) in self.jobs.items() if submitted < cutoff]:
+                del self.jobs[job_id]
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                op = request.get('op')
+                if op == 'submit':
+                    conn.send({'job_id': self.submit(request['kind'], request['frames'],
+                                                     request.get('classroom_id'), request.get('roster'))})
+                elif op == 'result':
+                    conn.send(self.result(request['job_id'], request.get('timeout', 0)))
+                else:
+                    conn.send({'status': 'error', 'error': f'Unknown op {op!r}'})
+
+    def serve_forever(self):
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)  # Stale socket from a previous run
+        with Listener(self.address, authkey=worker_authkey()) as listener:
+            if isinstance(self.address, str):
+                os.chmod(self.address, 0o600)
+            logger.info('Recognition service listening on %s', self.address)
+            while True:
+                conn = listener.accept()
+                self._expire()
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+
+class RecognitionClient:
+    """Web-tier side: submit jobs and poll or wait for their results."""
+
+    def __init__(self, address=WORKER_ADDRESS):
+        self.address = _address(address)
+
+    def _call(self, request):
+        with Client(self.address, authkey=worker_authkey()) as conn:
+            conn.send(request)
+            return conn.recv()
+
+    def submit(self, kind, frames, classroom_id=None, roster=None):
+        return self._call({'op': 'submit', 'kind': kind, 'frames': frames,
+                           'classroom_id': classroom_id, 'roster': roster})['job_id']
+
+    def result(self, job_id, timeout=0):
+        return self._call({'op': 'result', 'job_id': job_id, 'timeout': timeout})
+
+    # Submit and block until the result is in, returning it (or raising on a failed job)
+    def recognize(self, kind, frames, classroom_id=None, roster=None, timeout=30):
+        response = self.result(self.submit(kind, frames, classroom_id, roster), timeout)
+        if response['status'] == 'done':
+            return response['result']
+        raise RuntimeError(response.get('error', f"Recognition job {response['status']}"))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    RecognitionService().serve_forever()
@@ -0,0 +1,42 @@
+import datetime
+
+import pytest
+
+import attendance_window
+from attendance_window import RecentAttendance, attendance_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(attendance_window.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_keys_expire_after_the_window(clock):
+    recent = RecentAttendance(ttl=60)
+    key = attendance_key('student', 'abc123', 4, datetime.date(2024, 5, 1))
+    assert not recent.seen(key)
+
+    recent.add(key)
+    clock[0] += 59
+    assert recent.seen(key)
+    clock[0] += 1
+    assert not recent.seen(key)
+
+
+def test_adding_again_restarts_the_window_and_purges_expired_keys(clock):
+    recent = RecentAttendance(ttl=60)
+    recent.add('a', 'b')
+    clock[0] += 40
+    recent.add('a')
+    clock[0] += 30
+    recent.add('c')
+    assert recent.seen('a') and not recent.seen('b')
+    assert set(recent._expiry) == {'a', 'c'}
+
+
+def test_key_normalizes_ids():
+    day = datetime.date(2024, 5, 1)
+    assert attendance_key('student', 17, '4', day) == attendance_key('student', '17', 4, day)
+    assert attendance_key('student', 17, 4, day) != attendance_key('teacher', 17, 4, day)
@@ -0,0 +1,31 @@
+import threading
+
+import pytest
+
+import detectors
+
+
+class StubDetector(detectors.FaceDetector):
+    def _detect(self, image):
+        return []
+
+
+def test_each_thread_gets_its_own_detector(monkeypatch):
+    monkeypatch.setitem(detectors.BACKENDS, 'stub', StubDetector)
+    monkeypatch.setattr(detectors, 'DETECTOR_BACKEND', 'stub')
+    monkeypatch.setattr(detectors, '_local', threading.local())
+
+    main = detectors.thread_detector()
+    assert detectors.thread_detector() is main
+    assert detectors.thread_detector(0) is not main and detectors.thread_detector(0).detection_width == 0
+
+    others = []
+    thread = threading.Thread(target=lambda: others.append(detectors.thread_detector()))
+    thread.start()
+    thread.join()
+    assert isinstance(others[0], StubDetector) and others[0] is not main
+
+
+def test_missing_cascade_fails_at_construction(tmp_path):
+    with pytest.raises(ValueError, match='cascade'):
+        detectors.CascadeDetector(str(tmp_path / 'missing.xml'))
@@ -0,0 +1,79 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import face_dataset
+import label_registry
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(label_registry, '_registry', {})
+    return tmp_path
+
+
+def _crops(value, count):
+    return [np.full((100, 100), value, dtype=np.uint8) for _ in range(count)]
+
+
+def _append_many(worker):
+    for batch in range(5):
+        face_dataset.append_samples(f'w{worker}', worker, _crops(worker * 10 + batch, 3))
+
+
+def test_append_records_ranges_per_student():
+    face_dataset.append_samples('abc123', 0, _crops(1, 2))
+    face_dataset.append_samples('cde123', 1, _crops(2, 3))
+    face_dataset.append_samples('abc123', 0, _crops(3, 1))
+
+    faces, labels, index = face_dataset.open_dataset()
+    assert index['count'] == 6
+    assert index['students'] == {'abc123': [[0, 2], [5, 1]], 'cde123': [[2, 3]]}
+    assert labels.tolist() == [0, 0, 1, 1, 1, 0]
+    assert [int(block[0, 0, 0]) for block in face_dataset.student_samples('abc123')] == [1, 3]
+
+
+def test_append_trims_bytes_left_by_an_interrupted_append():
+    face_dataset.append_samples('abc123', 0, _crops(1, 2))
+    fingerprint = face_dataset.dataset_fingerprint()
+    # A writer died after appending crops and labels but before updating the index
+    with open(face_dataset.FACES_PATH, 'ab') as f:
+        f.write(np.full((3, 100, 100), 9, dtype=np.uint8).tobytes())
+    with open(face_dataset.LABELS_PATH, 'ab') as f:
+        f.write(np.full(3, 7, dtype=np.int32).tobytes())
+
+    faces, labels, _ = face_dataset.open_dataset()
+    assert len(faces) == 2 and labels.tolist() == [0, 0]
+
+    face_dataset.append_samples('cde123', 1, _crops(5, 1))
+    faces, labels, index = face_dataset.open_dataset()
+    assert index['count'] == 3
+    assert labels.tolist() == [0, 0, 1]
+    assert int(faces[2, 0, 0]) == 5
+    assert face_dataset.dataset_fingerprint() != fingerprint
+
+
+def test_concurrent_appends_from_processes_do_not_overlap():
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_append_many, args=(worker,)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    faces, labels, index = face_dataset.open_dataset()
+    assert index['count'] == len(labels) == 60
+    # The students' ranges tile the file exactly: no gaps, no overlaps
+    position = 0
+    for offset, count in sorted(tuple(block) for blocks in index['students'].values() for block in blocks):
+        assert offset == position
+        position += count
+    assert position == 60
+    for student_id, blocks in index['students'].items():
+        worker = int(student_id[1:])
+        values = sorted(int(faces[offset, 0, 0]) for offset, _ in blocks)
+        assert values == [worker * 10 + batch for batch in range(5)]
+        assert all((labels[offset:offset + count] == worker).all() for offset, count in blocks)
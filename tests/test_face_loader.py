@@ -0,0 +1,20 @@
+import cv2
+import numpy as np
+
+import face_loader
+
+
+def test_serial_load_leaves_the_callers_opencv_threads_alone(tmp_path):
+    (tmp_path / 'abc123').mkdir()
+    for i in range(3):
+        cv2.imwrite(str(tmp_path / 'abc123' / f'abc123_{i}.jpg'), np.full((120, 120), 50 * i, dtype=np.uint8))
+
+    threads = cv2.getNumThreads()
+    cv2.setNumThreads(3)
+    try:
+        faces, labels = face_loader.load_training_set(str(tmp_path), {'abc123': 7}, workers=1)[:2]
+        assert cv2.getNumThreads() == 3
+    finally:
+        cv2.setNumThreads(threads)
+    assert len(faces) == 3 and list(labels) == [7, 7, 7]
+    assert faces[0].shape == face_loader.FACE_SIZE
@@ -0,0 +1,48 @@
+import json
+import multiprocessing
+
+import pytest
+
+import label_registry
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(label_registry, '_registry', {})
+    return tmp_path / label_registry.REGISTRY_PATH
+
+
+def _assign(student_ids, results):
+    results.put(label_registry.labels_for(student_ids))
+
+
+def test_labels_are_stable_and_persisted(registry):
+    first = label_registry.labels_for(['abc123', 'cde123'])
+    assert sorted(first.values()) == [0, 1]
+    assert label_registry.label_for('abc123') == first['abc123']
+    assert label_registry.label_for('new1') == 2
+    assert json.loads(registry.read_text()) == {'abc123': first['abc123'], 'cde123': first['cde123'], 'new1': 2}
+
+
+def test_processes_with_stale_caches_never_share_a_label(registry):
+    # Every worker starts with the same cached registry, then enrolls different students at once
+    label_registry.labels_for(['seed'])
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    batches = [[f'p{worker}s{student}' for student in range(20)] for worker in range(4)]
+    workers = [context.Process(target=_assign, args=(batch, results)) for batch in batches]
+    for worker in workers:
+        worker.start()
+    assigned = {}
+    for _ in workers:
+        assigned.update(results.get(timeout=30))
+    for worker in workers:
+        worker.join()
+
+    assert len(set(assigned.values())) == len(assigned) == 80
+    assert 0 not in assigned.values()
+    stored = json.loads(registry.read_text())
+    assert {student_id: stored[student_id] for student_id in assigned} == assigned
+    # A process whose cache predates the others still sees their labels
+    assert label_registry.labels_for(list(assigned)) == assigned
@@ -0,0 +1,15 @@
+import json
+
+import metrics
+
+
+def test_slow_stages_report_finite_percentiles(monkeypatch):
+    monkeypatch.setattr(metrics, '_histograms', {})
+    metrics.observe('train', 15000)
+    metrics.observe('train', 90000)
+
+    series, = metrics.snapshot()
+    assert series['p50_ms'] == 20000
+    assert series['p95_ms'] == metrics.BUCKETS_MS[-2]
+    json.dumps(series, allow_nan=False)
+    assert 'le="+Inf"} 2' in metrics.render_prometheus()
@@ -0,0 +1,16 @@
+import model_store
+
+
+def test_faces_fingerprint_extends_by_the_added_files(tmp_path):
+    (tmp_path / 'abc123').mkdir()
+    (tmp_path / 'abc123' / 'abc123_0.jpg').write_bytes(b'one')
+    before = model_store.faces_fingerprint(str(tmp_path))
+
+    added = [tmp_path / 'abc123' / 'abc123_1.jpg', tmp_path / 'cde123' / 'cde123_0.jpg']
+    added[1].parent.mkdir()
+    for path in added:
+        path.write_bytes(b'two')
+    after = model_store.faces_fingerprint(str(tmp_path))
+
+    assert after != before
+    assert model_store.combine_fingerprints(before, model_store.files_fingerprint(added, str(tmp_path))) == after
@@ -0,0 +1,146 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from nn_recognizer import NearestNeighbourRecognizer
+
+
+# A smooth random pattern per student; samples of one student differ by a small shift and noise
+def _base(rng):
+    coarse = rng.random((8, 8)).astype(np.float32)
+    return (cv2.resize(coarse, (100, 100), interpolation=cv2.INTER_CUBIC).clip(0, 1) * 255).astype(np.uint8)
+
+
+def _sample(base, rng):
+    dy, dx = rng.integers(-2, 3, size=2)
+    face = np.roll(base, (dy, dx), axis=(0, 1)).astype(np.int16) + rng.normal(0, 6, base.shape).astype(np.int16)
+    return np.clip(face, 0, 255).astype(np.uint8)
+
+
+@pytest.fixture(scope='module')
+def students():
+    rng = np.random.default_rng(0)
+    return [_base(rng) for _ in range(6)]
+
+
+def _training_set(students, per_student=8, seed=1):
+    rng = np.random.default_rng(seed)
+    faces = np.stack([_sample(base, rng) for base in students for _ in range(per_student)])
+    return faces, np.repeat(np.arange(len(students), dtype=np.int32), per_student)
+
+
+@pytest.fixture(params=['float32', 'uint8'])
+def recognizer(request, students):
+    recognizer = NearestNeighbourRecognizer(components=16, storage=request.param)
+    recognizer.train(*_training_set(students))
+    return recognizer
+
+
+def _queries(students, seed=2):
+    rng = np.random.default_rng(seed)
+    return np.stack([_sample(base, rng) for base in students])
+
+
+def test_predicts_each_student(recognizer, students):
+    labels, confidences = recognizer.predict_batch(_queries(students))
+    assert labels[:, 0].tolist() == list(range(len(students)))
+    assert recognizer.predict(_queries(students)[3])[0] == 3
+
+
+def test_topk_returns_distinct_labels_in_distance_order(recognizer, students):
+    matches = recognizer.predict_topk(_queries(students)[2], k=4)
+    labels = [label for label, _ in matches]
+    confidences = [confidence for _, confidence in matches]
+    assert labels[0] == 2 and len(set(labels)) == 4
+    assert confidences == sorted(confidences)
+
+
+def test_topk_pads_when_fewer_labels_than_k(recognizer, students):
+    labels, confidences = recognizer.predict_batch(_queries(students)[:1], k=len(students) + 2)
+    assert labels[0, -2:].tolist() == [-1, -1]
+    assert np.isinf(confidences[0, -2:]).all()
+
+
+def test_allowed_labels_mask_everyone_else(recognizer, students):
+    query = _queries(students)[1]
+    matches = recognizer.predict_topk(query, k=3, allowed_labels={4, 5})
+    assert {label for label, _ in matches} == {4, 5}
+    assert recognizer.predict_topk(query, k=1, allowed_labels={1})[0][0] == 1
+
+
+def test_subset_matches_the_masked_full_model(recognizer, students):
+    subset = recognizer.subset({0, 3, 5})
+    assert set(subset.labels.tolist()) == {0, 3, 5}
+    queries = _queries(students)
+    assert np.array_equal(subset.predict_batch(queries, k=2)[0],
+                          recognizer.predict_batch(queries, k=2, allowed_labels={0, 3, 5})[0])
+
+
+def test_write_and_read_round_trip(recognizer, students, tmp_path):
+    recognizer.write(str(tmp_path / 'model.arrays'))
+    loaded = NearestNeighbourRecognizer(storage='float16')
+    loaded.read(str(tmp_path / 'model.arrays'))
+
+    assert loaded.storage == recognizer.storage
+    assert np.array_equal(loaded.labels, recognizer.labels)
+    queries = _queries(students)
+    for expected, actual in zip(recognizer.predict_batch(queries, k=3), loaded.predict_batch(queries, k=3)):
+        np.testing.assert_allclose(actual, expected, rtol=1e-5)
+
+
+def test_extended_leaves_the_original_untouched(recognizer, students, tmp_path):
+    recognizer.write(str(tmp_path / 'model.arrays'))
+    stored = NearestNeighbourRecognizer()
+    stored.read(str(tmp_path / 'model.arrays'))  # Read-only memmaps
+
+    rng = np.random.default_rng(3)
+    newcomer = _base(rng)
+    for base in (recognizer, stored):
+        size = len(base.labels)
+        extended = base.extended(np.stack([_sample(newcomer, rng) for _ in range(4)]), [9] * 4)
+        again = extended.extended(np.stack([_sample(newcomer, rng) for _ in range(2)]), [9] * 2)
+        assert len(base.labels) == size and 9 not in base.labels
+        assert len(extended.labels) == size + 4 and len(again.labels) == size + 6
+        assert again.predict(_sample(newcomer, rng))[0] == 9
+
+
+# The two photos shipped in faces/, preprocessed the way enrollment does
+def _photo(student_id):
+    faces_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'faces', student_id)
+    return cv2.imread(os.path.join(faces_dir, sorted(os.listdir(faces_dir))[0]), cv2.IMREAD_GRAYSCALE)
+
+
+def _preprocess(image):
+    return cv2.resize(cv2.equalizeHist(image), (100, 100))
+
+
+def _perturbed(image, dx, dy, angle, gain):
+    height, width = image.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    matrix[:, 2] += (dx, dy)
+    moved = cv2.warpAffine(image, matrix, (width, height), borderMode=cv2.BORDER_REFLECT)
+    return np.clip(moved.astype(np.float32) * gain, 0, 255).astype(np.uint8)
+
+
+PERTURBATIONS = [(dx, dy, angle, gain) for dx in (-3, 3) for dy in (-3, 3) for angle in (-2, 2) for gain in (0.8, 1.2)]
+
+
+def test_default_threshold_accepts_the_same_person_and_rejects_another():
+    photos = {student_id: _photo(student_id) for student_id in ('abc123', 'cde123')}
+    threshold = NearestNeighbourRecognizer.threshold
+
+    both = NearestNeighbourRecognizer()
+    both.train([_preprocess(photos['abc123']), _preprocess(photos['cde123'])], [0, 1])
+    for label, student_id in enumerate(photos):
+        for perturbation in PERTURBATIONS:
+            predicted, confidence = both.predict(_preprocess(_perturbed(photos[student_id], *perturbation)))
+            assert predicted == label and confidence < threshold
+
+    # Someone who isn't enrolled is closest to the one stored face, but too far to be accepted
+    only_abc = NearestNeighbourRecognizer()
+    only_abc.train([_preprocess(photos['abc123'])], [0])
+    for perturbation in PERTURBATIONS:
+        _, confidence = only_abc.predict(_preprocess(_perturbed(photos['cde123'], *perturbation)))
+        assert confidence >= threshold
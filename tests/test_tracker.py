@@ -0,0 +1,49 @@
+from tracker import FaceTracker, iou
+
+
+def test_iou():
+    assert iou((0, 0, 10, 10), (0, 0, 10, 10)) == 1.0
+    assert iou((0, 0, 10, 10), (20, 20, 10, 10)) == 0.0
+    assert iou((0, 0, 10, 10), (5, 0, 10, 10)) == 50 / 150
+
+
+def test_detections_follow_their_tracks_by_overlap():
+    tracker = FaceTracker()
+    left, right = tracker.update([(0, 0, 50, 50), (200, 0, 50, 50)])
+
+    # Both faces moved a little and come back in the other order
+    seen = tracker.update([(205, 3, 50, 50), (4, 2, 50, 50)])
+    assert [track.track_id for track in seen] == [left.track_id, right.track_id]
+    assert left.box == (4, 2, 50, 50) and right.box == (205, 3, 50, 50)
+
+
+def test_far_detection_starts_a_new_track_and_missing_tracks_expire():
+    tracker = FaceTracker(max_misses=2)
+    first, = tracker.update([(0, 0, 50, 50)])
+    tracker.update([(300, 300, 50, 50)])
+    assert len(tracker.tracks) == 2 and first.misses == 1
+
+    tracker.update([(300, 300, 50, 50)])
+    tracker.update([(300, 300, 50, 50)])
+    assert first not in tracker.tracks
+    assert len(tracker.tracks) == 1
+
+
+def test_identity_settles_after_enough_agreeing_votes():
+    tracker = FaceTracker(votes_needed=3)
+    track, = tracker.update([(0, 0, 50, 50)])
+    tracker.vote(track, 7, 40.0)
+    tracker.vote(track, 2, 45.0)
+    tracker.vote(track, 7, 30.0)
+    assert track.identity is None
+    assert tracker.unresolved() == [track]
+
+    tracker.vote(track, 7, 35.0)
+    assert track.identity == 7
+    assert track.confidence == 30.0
+    assert tracker.unresolved() == []
+
+
+def test_detection_runs_every_few_frames():
+    tracker = FaceTracker(detect_every=3)
+    assert [tracker.next_frame() for _ in range(7)] == [True, False, False, True, False, False, True]
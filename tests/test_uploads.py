@@ -0,0 +1,18 @@
+import cv2
+import numpy as np
+
+import function
+from lbph_recognizer import LbphRecognizer
+
+
+def test_empty_or_corrupt_uploads_are_unreadable_not_errors():
+    assert function.decode_gray(b'') is None
+    assert function.decode_gray(b'not an image') is None
+    assert function.extract_face(b'') is None
+    assert function.recognize_frames(LbphRecognizer(), {}, [b'']) == [{'error': 'Unreadable image', 'faces': []}]
+
+
+def test_decode_gray_returns_a_grayscale_frame():
+    ok, encoded = cv2.imencode('.png', np.full((20, 30, 3), 128, dtype=np.uint8))
+    gray = function.decode_gray(encoded.tobytes())
+    assert gray.shape == (20, 30) and int(gray[0, 0]) == 128
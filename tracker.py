@@ -0,0 +1,86 @@
+import itertools
+from collections import Counter
+
+
+# Intersection over union of two (x, y, w, h) boxes
+def iou(box_a, box_b):
+    ax, ay, aw, ah = box_a
+    bx, by, bw, bh = box_b
+    inter_w = min(ax + aw, bx + bw) - max(ax, bx)
+    inter_h = min(ay + ah, by + bh) - max(ay, by)
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    intersection = inter_w * inter_h
+    return intersection / float(aw * ah + bw * bh - intersection)
+
+
+class Track:
+    """One face followed across frames, with a running vote over its predictions."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, box):
+        self.track_id = next(self._ids)
+        self.box = box
+        self.votes = Counter()
+        self.best_confidence = {}
+        self.identity = None  # Label, once enough predictions agree
+        self.misses = 0
+
+    @property
+    def confidence(self):
+        return self.best_confidence.get(self.identity)
+
+
+class FaceTracker:
+    """Associates detections across frames by IoU so each person is predicted only until identified.
+
+    Detection runs every `detect_every` frames; in between the tracks keep their last boxes.
+    A track's identity is fixed once `votes_needed` matching predictions agree on one label.
+    """
+
+    def __init__(self, detect_every=5, iou_threshold=0.3, votes_needed=3, max_misses=2):
+        self.detect_every = detect_every
+        self.iou_threshold = iou_threshold
+        self.votes_needed = votes_needed
+        self.max_misses = max_misses
+        self.tracks = []
+        self.frame_index = -1
+
+    # Advance one frame; True when this frame should run the detector
+    def next_frame(self):
+        self.frame_index += 1
+        return self.frame_index % self.detect_every == 0
+
+    # Match fresh detections to tracks (greedy, highest IoU first); returns the tracks seen this frame
+    def update(self, boxes):
+        pairs = sorted(((iou(track.box, box), t, b) for t, track in enumerate(self.tracks)
+                        for b, box in enumerate(boxes)), reverse=True)
+        matched_tracks, matched_boxes = set(), set()
+        for overlap, t, b in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if t in matched_tracks or b in matched_boxes:
+                continue
+            self.tracks[t].box = boxes[b]
+            self.tracks[t].misses = 0
+            matched_tracks.add(t)
+            matched_boxes.add(b)
+
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+        self.tracks.extend(Track(box) for b, box in enumerate(boxes) if b not in matched_boxes)
+        return [track for track in self.tracks if track.misses == 0]
+
+    # Tracks that still need predictions
+    def unresolved(self, tracks=None):
+        return [track for track in (self.tracks if tracks is None else tracks) if track.identity is None]
+
+    # Record an accepted prediction for a track; fixes its identity once the vote is decisive
+    def vote(self, track, label, confidence):
+        track.votes[label] += 1
+        track.best_confidence[label] = min(confidence, track.best_confidence.get(label, confidence))
+        if track.votes[label] >= self.votes_needed:
+            track.identity = label